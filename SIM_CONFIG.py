@@ -7,15 +7,90 @@ import numpy as np
 PLOTSIZE = 500
 # Sife length of the cells in the simulation, in mm
 CELL_SIDE_LENGTH_MM = 1
+# Optional region of interest, instead of the cube from 0 to PLOTSIZE cells along every axis
+# Each is an [x, y, z] list in mm, or None to use the cube's value on every axis
+# Position of the region's first cell
+GRID_ORIGIN_MM = None
+# Size of the region along each axis
+GRID_EXTENT_MM = None
+# Side length of the cells along each axis
+GRID_CELL_SIZE_MM = None
 # 2D or 3D simulation
 SIM3D = True
 # Adjusts how 3D data is displayed
 # 0 -> 2D slices through the volume, 1 -> Full 3D visualisation of the data
 VIEWMODE_3D = 1
+# If True, the 2D slice view (VIEWMODE_3D = 0) only computes the planes being shown, as they're shown
+LAZY_SLICES = False
+# Number of computed planes kept in memory with LAZY_SLICES
+SLICE_CACHE_SIZE = 64
+# Number of planes either side of the one being shown that are computed in the background with LAZY_SLICES
+SLICE_PREFETCH = 2
+# If True, an animation of the instantaneous sound pressure over one period of the wave is shown instead of the dB heatmap
+# In 3D, the XY plane through the middle of the volume is animated
+ANIMATE_PRESSURE = False
+# Number of animation frames per period of the sound wave
+ANIMATION_FRAMES_PER_PERIOD = 24
 # If True, the program uses Float32/Complex64 instead of Float64/Complex 128 for reduced memory usage
 COMPRESS_FLOAT = True
+# Optional fixed-point type for the dB results, instead of floats
+# None -> floats, "uint16" -> 0.01dB steps (up to 655dB), "uint8" -> 0.8dB steps (up to 204dB, for display only)
+OUTPUT_QUANTISATION = None
 # Max. number of CPU cores to be used in running the simulation
 CPU_CORES = 6
+# How work is split between CPU cores
+# "slab" -> each core computes every transducer for a slab of the grid, "transducer" -> one core per transducer
+PARALLEL_MODE = "slab"
+# How the work is run in parallel
+# "serial" -> in this process, "thread" -> worker threads, "process" -> worker processes, "auto" -> picked for each run
+EXECUTOR = "auto"
+# 3D computation engine
+# "direct" -> sums every transducer's wave at every point, "angular_spectrum" -> propagates a plane along z with FFTs
+ENGINE = "direct"
+# Index of the z-plane the angular spectrum engine propagates from (None -> first plane past every transducer)
+ANGULAR_SPECTRUM_SOURCE_INDEX = None
+# Number of grid cells (times transducers) the computation kernel works on at once
+# Should be small enough for the kernel's working memory to fit in the CPU cache - larger isn't faster
+# None -> sized automatically from the CPU's level 2 cache
+BLOCK_CELLS = None
+# If True, transducers sitting on a grid cell that point the same way share one precomputed field template
+# Much faster for large arrays, but each template can be up to 2^n times the size of the simulation matrix
+USE_FIELD_TEMPLATES = False
+# If True, only the unique half/quarter of the grid is computed for mirror-symmetric transducer arrays
+USE_SYMMETRY = True
+# If True, the grid is sampled coarsely first, and only refined in blocks where the sound varies quickly
+ADAPTIVE_REFINEMENT = False
+# Side length (in cells) of the coarsest blocks - must be a power of 2
+ADAPTIVE_BLOCK_CELLS = 16
+# Largest error (in dB) allowed when interpolating across a block, before the block is refined
+ADAPTIVE_TOLERANCE_DB = 1.0
+# Largest change in the wave's phase per cell (in radians) allowed across a block, before it's refined (None -> not used)
+ADAPTIVE_PHASE_TOLERANCE = None
+# If set to a directory path, 3D simulations are streamed to disk slab by slab instead of being held in memory
+# (with ADAPTIVE_REFINEMENT or the angular spectrum ENGINE, the whole results are computed first, then written to disk)
+STREAM_OUTPUT_PATH = None
+# Number of rows of the grid computed at once when streaming to disk (or computing coverage statistics)
+STREAM_SLAB_ROWS = 8
+# Number of downsampled (by 2x, 4x, 8x...) copies of the results written alongside them when streaming to disk
+# Used by the napari view to show large volumes straight away, loading the finer levels only when zoomed in (in 2D)
+STREAM_PYRAMID_LEVELS = 3
+# Levels (in dB/dBA) that the coverage statistics report the fraction of the grid at or above
+COVERAGE_THRESHOLDS_DB = [90]
+# Width (in dB) of each bin of the coverage statistics' histogram of levels
+COVERAGE_HISTOGRAM_BIN_DB = 1
+# Optional region that the coverage statistics report the mean level across, as [[x, y, z], [x, y, z]] opposite corners in mm
+COVERAGE_REGION_MM = None
+# If set to a directory path, results are cached there and reused whenever the simulation settings haven't changed
+RESULT_CACHE_DIR = None
+# Max. size of the result cache in bytes - the least recently used results are deleted beyond this
+RESULT_CACHE_MAX_BYTES = 20 * 1024**3
+# If True, each transducer's wave is cached too, so changing one transducer only recomputes that transducer
+# (but the first run is much slower, and takes a full complex matrix of disk space per transducer)
+RESULT_CACHE_TRANSDUCER_FIELDS = False
+# If True, the time and memory taken by each stage of the computation is recorded (slows the simulation down)
+PROFILE_STAGES = False
+# If set to a file path, the profiling report is written there as JSON after each simulation run
+PROFILE_OUTPUT_PATH = None
 # Simulated sound frequency in Hz
 FREQUENCY = 25000
 # Temperatue in degrees celcius (only applies if sound frequency audible - <20KHz)
@@ -43,6 +118,17 @@ TRANSDUCERS = [
 SINC_SCALEFACTOR = 1.15
 # In radians - the angle from the transducer's axis to the edge of its beam
 MAX_BEAM_ANGLE = 100*(np.pi/180)
+# How the beam angle response is evaluated
+# "function" -> userComputeBeamAngleResponse is called on the angle of every cell
+# "table" -> interpolated by the cosine of the angle, from a table built from userComputeBeamAngleResponse
+# Measured data (DIRECTIVITY_DATA_PATH) is always tabulated
+DIRECTIVITY_MODE = "function"
+# Number of entries in the directivity lookup table
+DIRECTIVITY_TABLE_SIZE = 65536
+# Optional CSV file of measured polar data (angle from the central axis in degrees, response) to build the table from
+DIRECTIVITY_DATA_PATH = None
+# If True, the response in DIRECTIVITY_DATA_PATH is in dB relative to the central axis, otherwise it's a relative amplitude
+DIRECTIVITY_DATA_DB = True
 
 def userComputeBeamAngleResponse(angles_matrix):
     """
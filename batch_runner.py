@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import numpy as np
+import SIM_CONFIG
+
+# Set in each worker process by _initBatchWorker()
+simulation = None
+_BASELINE_SETTINGS = {}
+
+def _loadScenarioFile(path):
+    """
+    Reads a JSON or TOML (by file extension) scenario file
+    The file holds either a list of scenarios, or a "scenarios" list with optional "defaults" shared by every scenario
+
+    Returns a list of scenario dicts, with the defaults filled in
+    """
+    if path.endswith(".toml"):
+        # Only in the standard library from Python 3.11
+        import tomllib
+
+        with open(path, "rb") as f:
+            contents = tomllib.load(f)
+    else:
+        with open(path) as f:
+            contents = json.load(f)
+
+    if isinstance(contents, list):
+        contents = {"scenarios": contents}
+
+    defaults = contents.get("defaults", {})
+
+    return [dict(defaults, **scenario) for scenario in contents["scenarios"]]
+
+def _checkScenarios(scenarios):
+    """
+    Gives every scenario a unique name, and checks its settings exist in SIM_CONFIG before any are run
+    Scenario keys in capitals are SIM_CONFIG settings (apart from CPU_CORES), "name" and "dims" set the output name and 2D/3D
+    """
+    names = set()
+
+    for scenario_no, scenario in enumerate(scenarios):
+        scenario.setdefault("name", f"scenario_{scenario_no}")
+        scenario.setdefault("dims", 3 if SIM_CONFIG.SIM3D else 2)
+
+        if scenario["name"] in names:
+            raise ValueError(f"Duplicate scenario name: {scenario['name']}")
+        names.add(scenario["name"])
+
+        if scenario["dims"] not in (2, 3):
+            raise ValueError(f"Scenario {scenario['name']} has dims {scenario['dims']}, must be 2 or 3")
+
+        for key in scenario:
+            if key not in ("name", "dims") and not (key.isupper() and hasattr(SIM_CONFIG, key)):
+                raise ValueError(f"Scenario {scenario['name']} has an unknown setting: {key}")
+
+        # Scenarios are run as single-core jobs - the batch is spread across cores by the number of workers instead
+        if "CPU_CORES" in scenario:
+            raise ValueError(f"Scenario {scenario['name']} sets CPU_CORES, but scenarios always run on one core - use --workers instead")
+
+def _initBatchWorker():
+    """
+    Pool initialiser - imports the simulation once per worker, so every scenario after the first starts warm
+    Records SIM_CONFIG's own settings, which each scenario starts from
+    """
+    global simulation, _BASELINE_SETTINGS
+    import simulation
+
+    simulation._logger = lambda string: None
+    _BASELINE_SETTINGS = {name: getattr(SIM_CONFIG, name) for name in dir(SIM_CONFIG) if name.isupper()}
+
+def _runScenario(task):
+    """
+    Worker function - runs one scenario on a single core, and writes its results into the output directory
+    task is a (scenario, output directory, whether to save the dB results) tuple
+
+    Returns the scenario's summary (or the error it failed with), as also written to its JSON file
+    """
+    scenario, output_dir, save_results = task
+    settings = {key: value for key, value in scenario.items() if key not in ("name", "dims")}
+    summary = {"name": scenario["name"], "dims": scenario["dims"]}
+
+    try:
+        # Every scenario starts from SIM_CONFIG, so settings from the worker's previous scenario don't carry over
+        settings = dict(_BASELINE_SETTINGS, **settings)
+        settings["CPU_CORES"] = 1
+        simulation.configureSimulation(**settings)
+        run_simulation = simulation.runVectorisedSimulation3D if scenario["dims"] == 3 else simulation.runVectorisedSimulation2D
+
+        start = time.perf_counter()
+        if save_results:
+            sim_matrix_db = run_simulation()
+            summary.update(simulation.computeCoverageStatistics(sim_matrix_db))
+        else:
+            # The statistics are computed slab by slab, without holding the dB results in memory
+            summary.update(simulation.runCoverageStatistics(scenario["dims"]))
+        summary["wall_time_s"] = time.perf_counter() - start
+        summary["settings"] = simulation._configMetadata()
+
+        if save_results:
+            # Quantised results are saved as they are, with the scale to convert them back into dB
+            np.savez_compressed(
+                os.path.join(output_dir, f"{scenario['name']}.npz"),
+                sim_matrix_db=np.asarray(sim_matrix_db),
+                db_scale=simulation.getQuantisationScale(sim_matrix_db.dtype) or 1.0
+            )
+    except Exception:
+        summary["error"] = traceback.format_exc()
+
+    with open(os.path.join(output_dir, f"{scenario['name']}.json"), "w") as f:
+        json.dump(summary, f, indent=4)
+
+    return summary
+
+def runBatch(scenarios, output_dir, workers=None, save_results=True):
+    """
+    Runs a list of scenarios as independent single-core jobs on one pool of worker processes
+    Each scenario is a dict of SIM_CONFIG settings to override (plus optional "name" and "dims")
+
+    Each scenario's coverage statistics are written to <name>.json in output_dir, and (if save_results)
+    its dB results to <name>.npz - a scenario that fails records its error instead of stopping the batch
+    Without save_results, the statistics are computed slab by slab with the direct engine, never holding the whole results
+    Returns the list of summaries, in the same order as the scenarios
+    """
+    _checkScenarios(scenarios)
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = [(scenario, output_dir, save_results) for scenario in scenarios]
+    summaries = {}
+
+    with multiprocessing.Pool(processes=workers or os.cpu_count(), initializer=_initBatchWorker) as pool:
+        # Scenarios are handed out one at a time, so long and short ones balance out between the workers
+        for summary in pool.imap_unordered(_runScenario, tasks, chunksize=1):
+            summaries[summary["name"]] = summary
+
+            if "error" in summary:
+                print(f"{summary['name']}: failed\n{summary['error']}")
+            else:
+                print(f"{summary['name']}: {summary['wall_time_s']:.3f}s, max {summary['max_db']:.1f}dB at {summary['max_position_mm']}mm")
+
+    summaries = [summaries[scenario["name"]] for scenario in scenarios]
+
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summaries, f, indent=4)
+
+    return summaries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs batches of simulation scenarios, without any plotting")
+    parser.add_argument("scenario_files", nargs="+", help="JSON or TOML files of scenarios")
+    parser.add_argument("--output", default="batch_results", help="Directory to write the results to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--metrics-only", action="store_true", help="Only write the coverage statistics, not the dB results")
+    args = parser.parse_args()
+
+    scenarios = []
+    for path in args.scenario_files:
+        scenarios += _loadScenarioFile(path)
+
+    runBatch(scenarios, args.output, args.workers, not args.metrics_only)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+def _benchmarkTransducers(n_transducers, plotsize, n_dims):
+    """
+    Generates a line of evenly spaced transducers facing along the y axis, across the middle of the grid
+    Positions are whole cells with CELL_SIDE_LENGTH_MM = 1
+    """
+    x_positions = np.linspace(0.2*plotsize, 0.8*plotsize, n_transducers).round()
+    z_position = round(plotsize/2) if n_dims == 3 else 0
+
+    return [[[float(x), round(0.1*plotsize), z_position], [0, 1, 0], 0] for x in x_positions]
+
+def _peakRSSMegabytes(who):
+    """
+    Peak resident memory of this process (or its finished children), in MB
+    """
+    # ru_maxrss is in kB on Linux, but bytes on macOS
+    scale = 1024**2 if platform.system() == "Darwin" else 1024
+
+    return resource.getrusage(who).ru_maxrss / scale
+
+def _runCase(case, reference_path, result_path):
+    """
+    Runs a single benchmark case in a fresh process, so its peak memory is measured on its own
+    The results are written as JSON to result_path
+    """
+    import simulation
+
+    simulation._logger = lambda string: None
+    simulation.configureSimulation(
+        PLOTSIZE=case["plotsize"],
+        CELL_SIDE_LENGTH_MM=1,
+        GRID_ORIGIN_MM=None,
+        GRID_EXTENT_MM=None,
+        GRID_CELL_SIZE_MM=None,
+        OUTPUT_QUANTISATION=None,
+        COMPRESS_FLOAT=case["compress_float"],
+        CPU_CORES=case["cpu_cores"],
+        TRANSDUCERS=_benchmarkTransducers(case["transducers"], case["plotsize"], case["dims"]),
+        STREAM_OUTPUT_PATH=None,
+        # The benchmark's line of transducers is symmetric - every cell is computed by the kernel, so the updates
+        # per second measure its real throughput rather than the cells skipped by these shortcuts
+        USE_SYMMETRY=False,
+        USE_FIELD_TEMPLATES=False,
+        ADAPTIVE_REFINEMENT=False,
+        ENGINE="direct",
+        # The reference always calls the beam angle response function, so the errors include any from the directivity table
+        DIRECTIVITY_MODE="function" if reference_path is None else simulation.DIRECTIVITY_MODE
+    )
+    run_simulation = simulation.runVectorisedSimulation3D if case["dims"] == 3 else simulation.runVectorisedSimulation2D
+
+    start = time.perf_counter()
+    sim_matrix_db = run_simulation()
+    wall_time = time.perf_counter() - start
+
+    result = dict(case)
+    result["wall_time_s"] = wall_time
+    result["cell_transducer_updates_per_s"] = (case["plotsize"]+1)**case["dims"] * case["transducers"] / wall_time
+    result["peak_rss_mb"] = _peakRSSMegabytes(resource.RUSAGE_SELF)
+    # Worker processes are only counted once they've finished, and the pool keeps them running between runs
+    simulation.shutdownWorkerPools()
+    result["peak_worker_rss_mb"] = _peakRSSMegabytes(resource.RUSAGE_CHILDREN)
+
+    if reference_path is None:
+        np.save(result_path + ".npy", sim_matrix_db)
+    else:
+        # Measured after the memory readings, so loading the reference doesn't count towards them
+        reference = np.load(reference_path, mmap_mode="r")
+        result["max_abs_error_db"] = float(np.max(np.abs(sim_matrix_db - reference)))
+        result["mean_abs_error_db"] = float(np.mean(np.abs(sim_matrix_db - reference)))
+
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+def _runIsolated(case, reference_path, result_path):
+    """
+    Runs a benchmark case in a separate (non-daemonic, so it can start its own pool) process
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=_runCase,
+        args=(case, reference_path, result_path)
+    )
+    process.start()
+    process.join()
+
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark case failed: {case}")
+
+    with open(result_path) as f:
+        return json.load(f)
+
+def runBenchmarks(dims, plotsizes, transducer_counts, compress_floats, cpu_cores, repeats):
+    """
+    Runs every combination of the given settings, returning a list of result dicts
+    Each result is compared against a float64, single-core reference run of the same grid and transducers,
+    which calls the beam angle response function directly (DIRECTIVITY_MODE = "function")
+    """
+    results = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for n_dims, plotsize, n_transducers in itertools.product(dims, plotsizes, transducer_counts):
+            reference_case = {
+                "dims": n_dims,
+                "plotsize": plotsize,
+                "transducers": n_transducers,
+                "compress_float": False,
+                "cpu_cores": 1
+            }
+            reference_path = os.path.join(temp_dir, "reference.json")
+            _runIsolated(reference_case, None, reference_path)
+
+            for compress_float, cores in itertools.product(compress_floats, cpu_cores):
+                case = dict(reference_case, compress_float=compress_float, cpu_cores=cores)
+
+                runs = [
+                    _runIsolated(case, reference_path + ".npy", os.path.join(temp_dir, "result.json"))
+                    for _ in range(repeats)
+                ]
+                # Keeping the fastest run, as the least disturbed by anything else running on the machine
+                result = min(runs, key=lambda i: i["wall_time_s"])
+                results.append(result)
+
+                print(
+                    f"{n_dims}D plotsize={plotsize} transducers={n_transducers} "
+                    f"compress_float={compress_float} cores={cores}: "
+                    f"{result['wall_time_s']:.3f}s, "
+                    f"{result['cell_transducer_updates_per_s']:.3g} updates/s, "
+                    f"{result['peak_rss_mb']:.0f}MB peak (workers {result['peak_worker_rss_mb']:.0f}MB), "
+                    f"max error {result['max_abs_error_db']:.2g}dB"
+                )
+
+    return results
+
+def _gitCommit():
+    """
+    Returns the current git commit hash, or None if it can't be found
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compareBenchmarks(old_results, new_results):
+    """
+    Prints the speed and memory change of each case found in both sets of results
+    """
+    case_keys = ("dims", "plotsize", "transducers", "compress_float", "cpu_cores")
+    old_cases = {tuple(i[k] for k in case_keys): i for i in old_results["results"]}
+
+    print(f"Comparing {old_results['commit']} -> {new_results['commit']}")
+    for new in new_results["results"]:
+        old = old_cases.get(tuple(new[k] for k in case_keys))
+        if old is None:
+            continue
+
+        print(
+            f"{new['dims']}D plotsize={new['plotsize']} transducers={new['transducers']} "
+            f"compress_float={new['compress_float']} cores={new['cpu_cores']}: "
+            f"{old['wall_time_s'] / new['wall_time_s']:.2f}x speed, "
+            f"{new['peak_rss_mb'] / old['peak_rss_mb']:.2f}x peak memory"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the simulation engine")
+    parser.add_argument("--dims", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--plotsizes", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--transducers", type=int, nargs="+", default=[3, 16])
+    parser.add_argument("--compress-float", type=int, nargs="+", default=[1, 0], help="1 -> float32, 0 -> float64")
+    parser.add_argument("--cores", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results from an earlier run to compare against")
+    args = parser.parse_args()
+
+    benchmark_results = {
+        "commit": _gitCommit(),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__
+        },
+        "results": runBenchmarks(
+            args.dims,
+            args.plotsizes,
+            args.transducers,
+            [bool(i) for i in args.compress_float],
+            sorted(set(args.cores)),
+            args.repeats
+        )
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(benchmark_results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compareBenchmarks(json.load(f), benchmark_results)
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 
+import sys
+from matplotlib.animation import FuncAnimation
 from matplotlib.widgets import Slider
 import matplotlib.pyplot as plt
 import napari
-from simulation import runVectorisedSimulation2D, runVectorisedSimulation3D
+import numpy as np
+from simulation import (
+    computeSlice, dequantiseDB, generatePressureFrames, getGridGeometry, getQuantisationScale, openSimulationPyramid,
+    openSimulationStore, runComplexSimulation
+)
+from result_cache import loadOrRunSimulation
+from lazy_slices import LazySliceVolume
 from SIM_CONFIG import *
 
 # Class to plot interactive 3D heatmaps using matplotlib
 class SoundSimPlot:
+    # dB results - if they're quantised, each slice is converted back into dB only as it's shown
     data_matrix = []
+    data_max = 0
+    # Downsampled copies of the data matrix, from finest to coarsest, if it was streamed to disk
+    data_pyramid = []
+    # Coordinates (in mm) of the cells along each axis of the data matrix, [y, x] in 2D and [y, x, z] in 3D
+    axes_values = []
 
     def _compute2DMatrixNonZeroMin(self, data):
         """
@@ -18,47 +32,180 @@ class SoundSimPlot:
         """
         # Higher than the max. theoretical pressure level
         current_min = (len(TRANSDUCERS)+1)*TRANSDUCER_TRANSMITTING_PRESSURE_LEVEL
-        for a in range(len(data)):
-            for b in range(len(data[a])):
-                if data[a][b] < current_min and data[a][b] != 0:
-                    current_min = data[a][b]
 
-        return current_min
+        return np.min(data, initial=current_min, where=data != 0)
+
+    def _setGridAxes(self, origin, cell_size):
+        """
+        Works out the coordinates (in mm) of the data matrix's cells, from the grid's origin and cell sizes along x, y and z
+        """
+        self.axes_values = [
+            origin[component] + np.arange(n_cells)*cell_size[component]
+            for component, n_cells in zip((1, 0, 2), self.data_matrix.shape)
+        ]
+
+    def _imageExtent(self, horizontal_axis, vertical_axis):
+        """
+        Returns the imshow extent (in mm) of an image with the given data matrix axes along it
+        Each cell's value is centred on its coordinates
+        """
+        extent = []
+        for axis in (horizontal_axis, vertical_axis):
+            values = self.axes_values[axis]
+            half_cell = (values[1] - values[0])/2 if len(values) > 1 else 0.5
+            extent += [values[0] - half_cell, values[-1] + half_cell]
+
+        return extent
+
+    def _sliceIndex(self, axis, val):
+        """
+        Converts a slider position (in mm) into the index of the nearest slice along that axis of the data matrix
+        """
+        return int(np.abs(self.axes_values[axis] - val).argmin())
+
+    def _sliceSlider(self, ax, label, axis):
+        """
+        Creates a slider to pick the position (in mm) of a slice along an axis of the data matrix
+        """
+        values = self.axes_values[axis]
+
+        return Slider(
+            ax = ax,
+            label=label,
+            valmin=values[0],
+            valmax=values[-1],
+            valstep=values,
+            valinit=values[0],
+            orientation="vertical"
+        )
 
     def plotSimulation2D(self):
         """
         Plots a 2-dimensional heatmap of the data using matplotlib
         """
-        self.data_matrix = runVectorisedSimulation2D()
+        self.data_matrix = loadOrRunSimulation(2)
+        origin, cell_size, _ = getGridGeometry()
+        self._setGridAxes(origin, cell_size)
 
         # Creates a standardised colour map for the heatmaps
         cmap = plt.get_cmap("plasma").copy()
         cmap.set_under("lightgrey")
 
-        plt.imshow(self.data_matrix,
+        sim_matrix_db = dequantiseDB(self.data_matrix)
+
+        plt.imshow(sim_matrix_db,
             cmap=cmap,
             interpolation="bilinear",
             origin="lower",
-            vmin=self._compute2DMatrixNonZeroMin(self.data_matrix),
-            vmax=self.data_matrix.max()
+            extent=self._imageExtent(1, 0),
+            vmin=self._compute2DMatrixNonZeroMin(sim_matrix_db),
+            vmax=sim_matrix_db.max()
         )
         plt.colorbar()
 
         plt.title(f"Ultrasound Intensity {"(dBA)" if dBA else "(dB)"}")
 
-        plt.xlabel("Distance (Cells)")
-        plt.ylabel("Distance (Cells)")
+        plt.xlabel("X (mm)")
+        plt.ylabel("Y (mm)")
 
         plt.gcf().canvas.manager.set_window_title("Sound Simulation")
 
         plt.show()
 
+    def plotPressureAnimation(self):
+        """
+        Plots a looping animation of the instantaneous sound pressure over one period of the wave using matplotlib
+        In 3D, the XY plane through the middle of the volume is animated
+        """
+        origin, cell_size, n_cells = getGridGeometry()
+        if SIM3D:
+            complex_field = computeSlice(2, n_cells[2]//2, output="complex")
+        else:
+            complex_field = runComplexSimulation(2)
+        self.data_matrix = complex_field
+        self._setGridAxes(origin, cell_size)
+
+        frames = [frame.copy() for frame in generatePressureFrames(complex_field)]
+        peak_pressure = np.abs(complex_field).max()
+
+        fig = plt.figure()
+        fig.canvas.manager.set_window_title("Sound Simulation")
+
+        # Symmetric colour scale, so zero pressure is always the middle colour
+        image = plt.imshow(frames[0],
+            cmap="RdBu_r",
+            interpolation="bilinear",
+            origin="lower",
+            extent=self._imageExtent(1, 0),
+            vmin=-peak_pressure,
+            vmax=peak_pressure
+        )
+        plt.colorbar()
+
+        if SIM3D:
+            plt.title(f"Instantaneous Sound Pressure (Pa), Z = {origin[2] + (n_cells[2]//2)*cell_size[2]:g} mm")
+        else:
+            plt.title("Instantaneous Sound Pressure (Pa)")
+        plt.xlabel("X (mm)")
+        plt.ylabel("Y (mm)")
+
+        def updateFrame(frame_no):
+            image.set_data(frames[frame_no])
+            return (image,)
+
+        # Kept in a variable, otherwise the animation is garbage collected before it's shown
+        animation = FuncAnimation(fig, updateFrame, frames=len(frames), interval=50, blit=True)
+
+        plt.show()
+
     def plotSimulation3D(self):
         """
         Calls the computation of the 3D data matrix, and then calls the desired visualisation function
+
+        With LAZY_SLICES, the slice view only computes the planes it shows, as it shows them
+        """
+        if LAZY_SLICES and VIEWMODE_3D == 0:
+            self.data_matrix = LazySliceVolume()
+            # The colour scale starts from the planes shown first, and grows as louder planes are shown
+            for index in ((slice(None), slice(None), 0), (slice(None), 0, slice(None)), (0, slice(None), slice(None))):
+                self.data_matrix[index]
+            self.data_max = self.data_matrix.max_db
+        else:
+            self.data_matrix = loadOrRunSimulation(3)
+            if STREAM_OUTPUT_PATH is not None:
+                # Streamed results record their max. in the store's metadata, which saves reading them all from disk
+                self.data_max = openSimulationStore(STREAM_OUTPUT_PATH)[1]["max_db"]
+                self.data_pyramid = openSimulationPyramid(STREAM_OUTPUT_PATH)[1:]
+            else:
+                self.data_max = dequantiseDB(self.data_matrix.max())
+        origin, cell_size, _ = getGridGeometry()
+        self._setGridAxes(origin, cell_size)
+
+        self._show3D()
+
+        if isinstance(self.data_matrix, LazySliceVolume):
+            self.data_matrix.close()
+
+    def plotStoredSimulation3D(self, store_path):
+        """
+        Opens a 3D simulation saved to disk by a streamed run, and calls the desired visualisation function
+        The data is memory-mapped, so only the parts being viewed are read from disk
         """
-        self.data_matrix = runVectorisedSimulation3D()
+        self.data_matrix, metadata = openSimulationStore(store_path)
+        self.data_max = metadata["max_db"]
+        self.data_pyramid = openSimulationPyramid(store_path)[1:]
+        # Stores written before regions of interest were added always start at the origin
+        self._setGridAxes(
+            metadata.get("GRID_ORIGIN_MM", [0, 0, 0]),
+            metadata.get("GRID_CELL_SIZE_MM", [metadata["CELL_SIDE_LENGTH_MM"]]*3)
+        )
+
+        self._show3D()
 
+    def _show3D(self):
+        """
+        Calls the desired visualisation function for the 3D data matrix
+        """
         if VIEWMODE_3D == 0:
             # Creates a colour map for the heatmap
             cmap = plt.get_cmap("plasma").copy()
@@ -75,12 +222,25 @@ class SoundSimPlot:
         # Initialising the viewer
         viewer = napari.Viewer(ndisplay=3)
 
-        # Adding my data to the viewer
+        # Adding my data to the viewer, scaled so its axes are in mm
+        # If there are downsampled copies of the data, it's added as a multiscale image - napari then only reads the
+        # coarsest level from disk to show the 3D view straight away, and loads the finer levels as you zoom in on
+        # slices in its 2D view (napari only ever renders the coarsest level of a multiscale image in 3D)
+        image_data = [self.data_matrix] + self.data_pyramid if self.data_pyramid else self.data_matrix
+        # Quantised results are shown as they are (in steps of db_scale dB), so they're never converted into floats
+        db_scale = getQuantisationScale(self.data_matrix.dtype)
+
         img = viewer.add_image(
-            self.data_matrix,
-            name="Ultrasound Intensity",
-            colormap="inferno"
+            image_data,
+            name="Ultrasound Intensity" if db_scale is None else f"Ultrasound Intensity (x{db_scale:g} dB)",
+            colormap="inferno",
+            scale=[i[1] - i[0] if len(i) > 1 else 1 for i in self.axes_values],
+            translate=[i[0] for i in self.axes_values],
+            multiscale=bool(self.data_pyramid),
+            # Saves napari reading through the whole volume to find them
+            contrast_limits=[0, self.data_max/(db_scale or 1)]
         )
+        viewer.dims.axis_labels = ("y (mm)", "x (mm)", "z (mm)")
 
         # Displaying a colorbar, and a box around the data cube
         img.colorbar.visible = True
@@ -89,16 +249,26 @@ class SoundSimPlot:
         # Setting the startup camera view
         viewer.camera.zoom = 0.5
         viewer.camera.angles = (0, 30, 30)
-        viewer.camera.center = (250, 250, 250)
+        viewer.camera.center = tuple((i[0] + i[-1])/2 for i in self.axes_values)
 
         napari.run()
 
+    def _refreshColourScale(self):
+        """
+        Lazily computed volumes don't know their max. value up front, so the colour scale grows as louder planes are shown
+        """
+        if isinstance(self.data_matrix, LazySliceVolume) and self.data_matrix.max_db > self.data_max:
+            self.data_max = self.data_matrix.max_db
+            for image in (self.im1, self.im2, self.im3):
+                image.set_clim(vmax=self.data_max)
+
     def _updateXYSlice(self, val):
         """
         Slider callback function
         Updates the XY slice of the heatmap data being visualizes
         """
-        self.im1.set_data(self.data_matrix[:, :, val])
+        self.im1.set_data(dequantiseDB(self.data_matrix[:, :, self._sliceIndex(2, val)]))
+        self._refreshColourScale()
         plt.draw()
 
     def _updateYZSlice(self, val):
@@ -106,7 +276,8 @@ class SoundSimPlot:
         Slider callback function
         Updates the YZ slice of the heatmap data being visualizes
         """
-        self.im2.set_data(self.data_matrix[:, val, :].T)
+        self.im2.set_data(dequantiseDB(self.data_matrix[:, self._sliceIndex(1, val), :]).T)
+        self._refreshColourScale()
         plt.draw()
 
     def _updateXZSlice(self, val):
@@ -114,7 +285,8 @@ class SoundSimPlot:
         Slider callback function
         Updates the XZ slice of the heatmap data being visualizes
         """
-        self.im3.set_data(self.data_matrix[val, :, :].T)
+        self.im3.set_data(dequantiseDB(self.data_matrix[self._sliceIndex(0, val), :, :]).T)
+        self._refreshColourScale()
         plt.draw()
 
     def _slicesThroughVolumeVisualisation(self, cmap):
@@ -137,61 +309,40 @@ class SoundSimPlot:
 
         cbar_ax = fig.add_axes([0.96, 0.15, 0.01, 0.75])
 
-        self.im1 = ax1.imshow(self.data_matrix[:, :, 0],
+        self.im1 = ax1.imshow(dequantiseDB(self.data_matrix[:, :, 0]),
             cmap=cmap,
             interpolation="bilinear",
             origin="lower",
-            vmax=self.data_matrix.max()
+            extent=self._imageExtent(1, 0),
+            vmax=self.data_max
         )
 
         # Adding slider to control which slice is shown in the heatmaps
-        xy_slice_slider = Slider(
-            ax = sl_ax1,
-            label ="Slice Z",
-            valmin=0,
-            valmax=PLOTSIZE,
-            valstep=1,
-            valinit=0,
-            orientation="vertical"
-        )
+        xy_slice_slider = self._sliceSlider(sl_ax1, "Slice Z", 2)
         xy_slice_slider.on_changed(self._updateXYSlice)
 
         # Repeating for other perspectives (XZ/YZ slices)
 
-        self.im2 = ax2.imshow(self.data_matrix[:, 0, :].T,
+        self.im2 = ax2.imshow(dequantiseDB(self.data_matrix[:, 0, :]).T,
             cmap=cmap,
             interpolation="bilinear",
             origin="lower",
-            vmax=self.data_matrix.max()
+            extent=self._imageExtent(0, 2),
+            vmax=self.data_max
         )
 
-        yz_slice_slider = Slider(
-            ax = sl_ax2,
-            label ="Slice X",
-            valmin=0,
-            valmax=PLOTSIZE,
-            valstep=1,
-            valinit=0,
-            orientation="vertical"
-        )
+        yz_slice_slider = self._sliceSlider(sl_ax2, "Slice X", 1)
         yz_slice_slider.on_changed(self._updateYZSlice)
 
-        self.im3 = ax3.imshow(self.data_matrix[0, :, :].T,
+        self.im3 = ax3.imshow(dequantiseDB(self.data_matrix[0, :, :]).T,
             cmap=cmap,
             interpolation="bilinear",
             origin="lower",
-            vmax=self.data_matrix.max()
+            extent=self._imageExtent(1, 2),
+            vmax=self.data_max
         )
 
-        xz_slice_slider = Slider(
-            ax = sl_ax3,
-            label ="Slice Y",
-            valmin=0,
-            valmax=PLOTSIZE,
-            valstep=1,
-            valinit=0,
-            orientation="vertical"
-        )
+        xz_slice_slider = self._sliceSlider(sl_ax3, "Slice Y", 0)
         xz_slice_slider.on_changed(self._updateXZSlice)
 
         fig.colorbar(self.im3, cax=cbar_ax)
@@ -201,12 +352,12 @@ class SoundSimPlot:
         ax2.set_title(f"YZ Ultrasound Intensity {"(dBA)" if dBA else "(dB)"}")
         ax3.set_title(f"XZ Ultrasound Intensity {"(dBA)" if dBA else "(dB)"}")
 
-        ax1.set_xlabel("Distance (Cells)")
-        ax2.set_xlabel("Distance (Cells)")
-        ax3.set_xlabel("Distance (Cells)")
-        ax1.set_ylabel("Distance (Cells)")
-        ax2.set_ylabel("Distance (Cells)")
-        ax3.set_ylabel("Distance (Cells)")
+        ax1.set_xlabel("X (mm)")
+        ax2.set_xlabel("Y (mm)")
+        ax3.set_xlabel("X (mm)")
+        ax1.set_ylabel("Y (mm)")
+        ax2.set_ylabel("Z (mm)")
+        ax3.set_ylabel("Z (mm)")
 
         plt.show()
 
@@ -214,7 +365,12 @@ class SoundSimPlot:
 if __name__ == "__main__":
     plotting = SoundSimPlot()
 
-    if SIM3D:
+    # A directory path argument opens a previously streamed 3D simulation instead of running a new one
+    if len(sys.argv) > 1:
+        plotting.plotStoredSimulation3D(sys.argv[1])
+    elif ANIMATE_PRESSURE:
+        plotting.plotPressureAnimation()
+    elif SIM3D:
         plotting.plotSimulation3D()
     else:
         plotting.plotSimulation2D()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import simulation
+from simulation import computeSlice
+
+class LazySliceVolume:
+    """
+    Stands in for the 3D dB results in the slice viewer, without computing the whole volume
+    Indexing a single plane (e.g. volume[:, :, z]) computes just that plane, keeping the most recently used planes
+    in an LRU cache - the planes either side of it are then computed in a background thread, ready to be shown next
+    """
+    def __init__(self, cache_size=None, prefetch=None):
+        self.cache_size = simulation.SLICE_CACHE_SIZE if cache_size is None else cache_size
+        self.prefetch = simulation.SLICE_PREFETCH if prefetch is None else prefetch
+
+        self.shape = tuple(len(i) for i in simulation._gridAxes(3))
+        self.ndim = 3
+        # Loudest volume found so far, in dB/dBA
+        self.max_db = 0
+
+        self._planes = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __getitem__(self, index):
+        """
+        Returns a plane of the volume - index must hold a single integer, with the other two axes sliced
+        """
+        plane_axes = [axis for axis, i in enumerate(index) if not isinstance(i, slice)]
+        if len(index) != 3 or len(plane_axes) != 1:
+            raise IndexError("Lazily computed volumes can only be indexed one plane at a time")
+
+        matrix_axis = plane_axes[0]
+        plane_index = range(self.shape[matrix_axis])[index[matrix_axis]]
+        plane = self._getPlane(matrix_axis, plane_index)
+
+        return plane[tuple(i for axis, i in enumerate(index) if axis != matrix_axis)]
+
+    def _computePlane(self, key):
+        """
+        Computes a plane, and adds it to the cache - dropping the least recently used planes if it's full
+        key is a (matrix axis, index) tuple
+        """
+        plane = computeSlice(*key)
+
+        with self._lock:
+            self._planes[key] = plane
+            self._pending.pop(key, None)
+            while len(self._planes) > self.cache_size:
+                self._planes.popitem(last=False)
+
+            self.max_db = max(self.max_db, float(plane.max()))
+
+        return plane
+
+    def _getPlane(self, matrix_axis, plane_index):
+        """
+        Returns a plane from the cache, waiting for it if it's already being computed, or computing it if not
+        """
+        key = (matrix_axis, plane_index)
+
+        with self._lock:
+            plane = self._planes.get(key)
+            pending = self._pending.get(key)
+            if plane is not None:
+                self._planes.move_to_end(key)
+
+        if plane is None:
+            plane = pending.result() if pending is not None else self._computePlane(key)
+
+        self._prefetchPlanes(matrix_axis, plane_index)
+
+        return plane
+
+    def _prefetchPlanes(self, matrix_axis, plane_index):
+        """
+        Queues the planes either side of the one being shown to be computed in the background
+        Queued planes that are no longer near the one being shown are dropped, so fast scrubbing doesn't build a backlog
+        """
+        nearby = [
+            plane_index + offset for offset in range(-self.prefetch, self.prefetch+1)
+            if offset != 0 and 0 <= plane_index + offset < self.shape[matrix_axis]
+        ]
+
+        with self._lock:
+            for key, pending in list(self._pending.items()):
+                if key[0] == matrix_axis and key[1] not in nearby and pending.cancel():
+                    del self._pending[key]
+
+            for i in nearby:
+                key = (matrix_axis, i)
+                if key not in self._planes and key not in self._pending:
+                    self._pending[key] = self._executor.submit(self._computePlane, key)
+
+    def close(self):
+        """
+        Stops the background thread, dropping any planes still queued
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+import simulation
+from simulation import computeTransducerField, runVectorisedSimulation2D, runVectorisedSimulation3D
+
+def _beamResponseFingerprint():
+    """
+    Describes the user-defined beam angle response function, so any edit to it changes the cache keys
+    Includes the source code, and the values of any config constants it refers to (e.g. SINC_SCALEFACTOR),
+    and the contents of DIRECTIVITY_DATA_PATH if it's set
+    """
+    try:
+        source = inspect.getsource(simulation.userComputeBeamAngleResponse)
+    except (OSError, TypeError):
+        source = simulation.userComputeBeamAngleResponse.__code__.co_code.hex()
+
+    constants = {}
+    for name in simulation.userComputeBeamAngleResponse.__code__.co_names:
+        value = simulation.userComputeBeamAngleResponse.__globals__.get(name)
+        if isinstance(value, (bool, int, float, str)):
+            constants[name] = value
+
+    # Measured directivity data replaces the function, so its contents are part of the key too
+    data = None
+    if simulation.DIRECTIVITY_DATA_PATH is not None:
+        with open(simulation.DIRECTIVITY_DATA_PATH, "rb") as f:
+            data = hashlib.sha256(f.read()).hexdigest()
+
+    return {"source": source, "constants": constants, "directivity_data": data}
+
+def _hashKey(key_data):
+    """
+    Hashes a JSON-serialisable description of a cache entry into its key
+    """
+    encoded = json.dumps(key_data, sort_keys=True, default=str).encode()
+
+    return hashlib.sha256(encoded).hexdigest()
+
+def _sharedKeyData(n_dims):
+    """
+    Returns every setting that affects the results, apart from the transducer array itself
+    and the output's quantisation (which doesn't affect the transducers' cached waves)
+    """
+    key_data = simulation._configMetadata()
+    del key_data["TRANSDUCERS"]
+    del key_data["OUTPUT_QUANTISATION"]
+    key_data["n_dims"] = n_dims
+    key_data["beam_response"] = _beamResponseFingerprint()
+    # 3D simulations can use either engine, which give different results
+    key_data["ENGINE"] = simulation.ENGINE
+    key_data["ANGULAR_SPECTRUM_SOURCE_INDEX"] = simulation.ANGULAR_SPECTRUM_SOURCE_INDEX
+
+    return key_data
+
+def _entryPath(kind, key):
+    """
+    Path of a cache entry - kind is "volumes" (dB results) or "transducers" (zero-phase complex waves)
+    """
+    return os.path.join(simulation.RESULT_CACHE_DIR, kind, f"{key}.npy")
+
+def _loadEntry(path):
+    """
+    Memory-maps a cache entry, marking it as recently used
+    Returns None if the entry isn't in the cache
+    """
+    if not os.path.exists(path):
+        return None
+
+    os.utime(path)
+
+    return np.load(path, mmap_mode="r")
+
+def _saveEntry(path, matrix):
+    """
+    Writes a cache entry, via a temporary file so a half-written entry is never picked up
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(temp_path, path)
+
+def _evictEntries(in_use):
+    """
+    Deletes the least recently used entries until the cache is within RESULT_CACHE_MAX_BYTES
+    Entries whose paths are in in_use are kept regardless
+    """
+    entries = []
+    for kind in ("volumes", "transducers"):
+        directory = os.path.join(simulation.RESULT_CACHE_DIR, kind)
+        if not os.path.isdir(directory):
+            continue
+
+        for name in os.listdir(directory):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(directory, name)))
+
+    total_bytes = sum(i[1] for i in entries)
+
+    # Oldest entries first
+    for _, size, path in sorted(entries):
+        if total_bytes <= simulation.RESULT_CACHE_MAX_BYTES:
+            break
+        if path in in_use:
+            continue
+
+        os.remove(path)
+        total_bytes -= size
+
+def _computeFromTransducerEntries(n_dims, shared_key_data, in_use):
+    """
+    Sums the cached zero-phase wave of each transducer (computing only those that are missing),
+    applying each transducer's phase offset, and returns the dB results (quantised if OUTPUT_QUANTISATION is set)
+    """
+    shape = tuple(len(i) for i in simulation._gridAxes(n_dims))
+    sim_matrix = np.zeros(shape, dtype=simulation._COMPLEX_TYPE)
+
+    for transducer_no, (position, transducer_axis, transducer_phase) in enumerate(simulation._TRANSDUCER_PARAMETERS):
+        key = _hashKey([shared_key_data, list(position), transducer_axis.tolist()])
+        path = _entryPath("transducers", key)
+
+        field = _loadEntry(path)
+        if field is None:
+            simulation._logger(f"Transducer {transducer_no} not cached, computing")
+            field = computeTransducerField(n_dims, transducer_no)
+            _saveEntry(path, field)
+        in_use.add(path)
+
+        sim_matrix += field * simulation._COMPLEX_TYPE(np.exp(1j*transducer_phase))
+        del field
+
+    return simulation._convertTodB(sim_matrix, quantise=simulation.OUTPUT_QUANTISATION is not None)
+
+def loadOrRunSimulation(n_dims):
+    """
+    Returns the dB results for the current simulation settings (2D or 3D) from the on-disk cache,
+    only running the simulation if it hasn't been cached yet
+    Cached results are memory-mapped rather than loaded into memory
+
+    Runs the simulation directly if RESULT_CACHE_DIR isn't set, if the results are being streamed to disk,
+    or if ADAPTIVE_REFINEMENT is on (as its results are approximate)
+    """
+    run_simulation = runVectorisedSimulation3D if n_dims == 3 else runVectorisedSimulation2D
+    # Settings are read through simulation, so they include any changes made by configureSimulation()
+    streamed = n_dims == 3 and simulation.STREAM_OUTPUT_PATH is not None
+    if simulation.RESULT_CACHE_DIR is None or simulation.ADAPTIVE_REFINEMENT or streamed:
+        return run_simulation()
+
+    shared_key_data = _sharedKeyData(n_dims)
+    metadata = simulation._configMetadata()
+    path = _entryPath("volumes", _hashKey([shared_key_data, metadata["TRANSDUCERS"], metadata["OUTPUT_QUANTISATION"]]))
+
+    sim_matrix_db = _loadEntry(path)
+    if sim_matrix_db is not None:
+        simulation._logger("Loaded simulation from cache")
+        return sim_matrix_db
+
+    in_use = {path}
+    # Each transducer's wave is computed with the direct engine, so the angular spectrum engine always runs in full
+    if simulation.RESULT_CACHE_TRANSDUCER_FIELDS and (n_dims == 2 or simulation.ENGINE == "direct"):
+        sim_matrix_db = _computeFromTransducerEntries(n_dims, shared_key_data, in_use)
+    else:
+        sim_matrix_db = run_simulation()
+
+    _saveEntry(path, sim_matrix_db)
+    _evictEntries(in_use)
+
+    return sim_matrix_db
@@ -1,23 +1,78 @@
 #!/usr/bin/env python3
 
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from multiprocessing import Pool, Lock, shared_memory
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
 import numpy as np
+import SIM_CONFIG
 from SIM_CONFIG import *
 
-# Calculating tempearture-adjusted speed of sound
 _DEG_C_TO_KELVIN = 273.15
-_T_kel = TEMPERATURE_DEG_C + _DEG_C_TO_KELVIN
-_T_REL = _T_kel / (_DEG_C_TO_KELVIN + 20)
-_C = 343.2*(_T_REL**0.5)
-# Wavelength in MM
-_WAVELENGTH = (_C/FREQUENCY)*1000
-# Used for calculating absolute volume of ultrasound at every point
-_PRESS_AMPLITUDE = 0.00002 * (10**(TRANSDUCER_TRANSMITTING_PRESSURE_LEVEL/20))
-# Transducer position vector list, in terms of simulation cells (not mm)
-_TRANSDUCER_POS_VECTORS = [np.array(i[0]) / CELL_SIDE_LENGTH_MM for i in TRANSDUCERS]
-_TRANSDUCER_AXIS_VECTORS = [np.array(i[1]) for i in TRANSDUCERS]
-_FLOAT_TYPE = np.float32 if COMPRESS_FLOAT else np.float64
-_COMPLEX_TYPE = np.complex64 if COMPRESS_FLOAT else np.complex128
+# Number of slabs handed to each CPU core in slab mode, so uneven slabs still balance out
+_SLABS_PER_CORE = 4
+# Which transducer vector component (x=0, y=1, z=2) runs along each axis of the simulation matrices
+_MATRIX_AXIS_COMPONENTS = (1, 0, 2)
+# Factor each plane is widened by for angular spectrum propagation, so waves entering from outside the grid are included
+_ANGULAR_SPECTRUM_PADDING = 2
+# Factor the widened plane is zero-padded by before its FFT, so waves leaving one side don't wrap around into the other
+_ANGULAR_SPECTRUM_GUARD = 2
+# Memory used for each chunk of batched results in phase sweeps, in bytes
+_SWEEP_CHUNK_BYTES = 64 * 1024**2
+# Memory a frequency sweep's per-frequency results can use before they're kept in a temporary file instead, in bytes
+_SWEEP_FIELDS_BYTES = 1024**3
+
+# Settings overridden with configureSimulation(), re-applied in every worker process
+_CONFIG_OVERRIDES = {}
+
+# Zero-phase field templates, keyed by transducer axis vector and grid spacing
+# Each entry is (offset of the template's first cell from the transducer, in cells, template matrix)
+_FIELD_TEMPLATE_CACHE = {}
+
+# Per-stage profiling records, {(process id, transducer position, stage name): [seconds, calls, allocated bytes, peak bytes]}
+_PROFILE = {}
+_NO_PROFILING = nullcontext()
+# [memory traced at the start, peak memory traced so far] of each stage being recorded, innermost last
+_PROFILE_STACK = []
+# Whether tracemalloc was started for profiling, so it's only stopped if it was
+_PROFILE_TRACING = False
+
+# Handles to the shared result matrix - attached by each worker process for a task, the lock set by _initPoolWorker()
+_SHARED_MEMORY = None
+_SHARED_LOCK = None
+# Used by worker threads instead, to add whole matrices into the result matrix one at a time
+_THREAD_LOCK = threading.Lock()
+
+# Long-lived worker pools, reused between runs
+# The process pool is restarted if CPU_CORES or any setting is changed after it's started
+_PROCESS_POOL = None
+_PROCESS_POOL_KEY = None
+_THREAD_POOL = None
+_THREAD_POOL_SIZE = None
+# Incremented each time the settings are changed
+_CONFIG_GENERATION = 0
+
+# With EXECUTOR = "auto", runs with fewer cell-transducer updates than this are run in serial
+_AUTO_SERIAL_UPDATES = 10**6
+# With EXECUTOR = "auto", runs with more updates than this use worker processes (their start-up cost being negligible)
+_AUTO_PROCESS_UPDATES = 4 * 10**8
+# Rough memory taken by each worker process, on top of its share of the work
+_PROCESS_WORKER_BYTES = 100 * 1024**2
+
+# dB per step of quantised dB results, for each OUTPUT_QUANTISATION type (their offset is always 0dB)
+_QUANTISATION_SCALES_DB = {"uint16": 0.01, "uint8": 0.8}
+
+# Approximate working memory of the computation kernel per cell of a block (in bytes), across all its temporaries
+_KERNEL_BYTES_PER_CELL = 64
+# Cells per block if BLOCK_CELLS is None and the CPU's cache size can't be found
+_DEFAULT_BLOCK_CELLS = 32768
 
 def _logger(string):
     """
@@ -25,31 +80,159 @@ def _logger(string):
     """
     print(string)
 
-def _computeDBAWeight():
+def _profileStage(stage, transducer_positions=(None,)):
+    """
+    Returns a context manager that records the duration and memory allocated by a named stage of the computation
+    transducer_positions lists the positions of the transducers the stage is run for - a stage run for a batch
+    of transducers at once has its duration and memory split evenly between them
+    Does nothing (with negligible overhead) unless PROFILE_STAGES is True
+    """
+    if not PROFILE_STAGES:
+        return _NO_PROFILING
+
+    return _recordStage(stage, transducer_positions)
+
+@contextmanager
+def _recordStage(stage, transducer_positions):
+    """
+    Context manager timing a stage, and tracking the peak memory NumPy allocates during it using tracemalloc
+    Stages can be nested - the peak memory traced so far by the enclosing stage is kept before the peak is reset
+    """
+    global _PROFILE_TRACING
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _PROFILE_TRACING = True
+
+    if _PROFILE_STACK:
+        _PROFILE_STACK[-1][1] = max(_PROFILE_STACK[-1][1], tracemalloc.get_traced_memory()[1])
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    _PROFILE_STACK.append([start_bytes, start_bytes])
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        start_bytes, peak_bytes = _PROFILE_STACK.pop()
+        peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+        allocated_bytes = peak_bytes - start_bytes
+        # The enclosing stage's peak includes this stage's
+        if _PROFILE_STACK:
+            _PROFILE_STACK[-1][1] = max(_PROFILE_STACK[-1][1], peak_bytes)
+
+        for transducer_position in transducer_positions:
+            record = _PROFILE.setdefault((os.getpid(), transducer_position, stage), [0.0, 0, 0, 0])
+            record[0] += seconds / len(transducer_positions)
+            record[1] += 1
+            record[2] += allocated_bytes // len(transducer_positions)
+            record[3] = max(record[3], allocated_bytes // len(transducer_positions))
+
+def _stopProfileTracing():
+    """
+    Stops tracemalloc once PROFILE_STAGES is turned off, if it was started for profiling, as it slows down every allocation
+    """
+    global _PROFILE_TRACING
+
+    if _PROFILE_TRACING and not PROFILE_STAGES:
+        tracemalloc.stop()
+        _PROFILE_TRACING = False
+
+def _takeProfile():
+    """
+    Returns this process's profiling records, and clears them
+    Used to pass worker processes' records back to the parent
+    """
+    records = dict(_PROFILE)
+    _PROFILE.clear()
+
+    return records
+
+def _mergeProfile(records):
+    """
+    Adds profiling records from a worker process to this process's records
+    """
+    for key, (seconds, calls, allocated_bytes, peak_bytes) in records.items():
+        record = _PROFILE.setdefault(key, [0.0, 0, 0, 0])
+        record[0] += seconds
+        record[1] += calls
+        record[2] += allocated_bytes
+        record[3] = max(record[3], peak_bytes)
+
+def getProfileReport(reset=False):
+    """
+    Returns the stages recorded while PROFILE_STAGES is True, as a JSON-serialisable dict:
+        "stages" -> a record per process, transducer and stage
+        "totals" -> each stage's records summed over every process and transducer
+    Durations are in seconds, memory in bytes - allocated_bytes is the sum over every call of the memory
+    allocated during the call, peak_bytes is the most allocated during a single call
+    """
+    stages = []
+    totals = {}
+    for (pid, transducer_position, stage), (seconds, calls, allocated_bytes, peak_bytes) in _PROFILE.items():
+        stages.append({
+            "pid": pid,
+            "transducer": None if transducer_position is None else list(transducer_position),
+            "stage": stage,
+            "seconds": seconds,
+            "calls": calls,
+            "allocated_bytes": allocated_bytes,
+            "peak_bytes": peak_bytes
+        })
+
+        total = totals.setdefault(stage, {"seconds": 0.0, "calls": 0, "allocated_bytes": 0, "peak_bytes": 0})
+        total["seconds"] += seconds
+        total["calls"] += calls
+        total["allocated_bytes"] += allocated_bytes
+        total["peak_bytes"] = max(total["peak_bytes"], peak_bytes)
+
+    if reset:
+        _PROFILE.clear()
+
+    return {"stages": stages, "totals": totals}
+
+def _writeProfileReport():
+    """
+    Writes the profiling report to PROFILE_OUTPUT_PATH as JSON, if profiling is enabled and a path is set
+    """
+    if PROFILE_STAGES and PROFILE_OUTPUT_PATH is not None:
+        with open(PROFILE_OUTPUT_PATH, "w") as f:
+            json.dump(getProfileReport(), f, indent=4)
+
+def _computeDBAWeight(frequency=None):
     """
     Calculates the adjustment value to convert from decibels to A-weighted decibels.
+    Uses the simulation FREQUENCY unless another frequency is given
 
     Uses the standard calculation formula.
     """
-    numerator = 148693636*FREQUENCY**4
-    denominator = (FREQUENCY**2 + 20.6**2)*np.sqrt((FREQUENCY**2+107.7**2)*(FREQUENCY**2+737.9**2))
-    denominator *= FREQUENCY**2+12194**2
+    if frequency is None:
+        frequency = FREQUENCY
+
+    numerator = 148693636*frequency**4
+    denominator = (frequency**2 + 20.6**2)*np.sqrt((frequency**2+107.7**2)*(frequency**2+737.9**2))
+    denominator *= frequency**2+12194**2
 
     ra = numerator/denominator
     aweight = 20*np.log10(ra)+2
 
     return aweight
 
-def _computeAttenuationConstant():
+def _computeAttenuationConstant(frequency=None):
     """
     Computes an attenuation constant for the simulation
     If ultrasound is being simulated - use the Stokes-Kirchoff model (accounting for viscosity/thermal conductivity of air)
     If normal sound being simulated - use the ISO 9613-1 model (accounting for molecular relaxation)
+    Uses the simulation FREQUENCY unless another frequency is given
 
     These are the dominant factors for audible vs. ultrasound attenuation in atmosphere
     """
-    if FREQUENCY > 20000:
-        constant = (2*1.85e-5*(2*np.pi*FREQUENCY)**2)/(3*1.225*(343**3))
+    if frequency is None:
+        frequency = FREQUENCY
+
+    if frequency > 20000:
+        constant = (2*1.85e-5*(2*np.pi*frequency)**2)/(3*1.225*(343**3))
     else:
         T_01 = _DEG_C_TO_KELVIN + 0.01
         Tho = 2239.1
@@ -57,7 +240,7 @@ def _computeAttenuationConstant():
         P_rel = PRESSURE_KPA / 101.325
         Xo = 0.209
         Xn = 0.781
-        f_khz = FREQUENCY / 1000
+        f_khz = frequency / 1000
 
         P_sat_P_ref = 10**(-6.8346*(T_01 / _DEG_C_TO_KELVIN)**1.261+4.6151)
         H = RELATIVE_HUMIDITY*(P_sat_P_ref / P_rel)
@@ -78,18 +261,154 @@ def _computeAttenuationConstant():
 
     return constant
 
-# TODO: Move this somewhere else as this is ugly
-# In Nepers/m
-_ATTENUATION_CONSTANT = _computeAttenuationConstant()
+def _buildDirectivityTable():
+    """
+    Tabulates the beam angle response against the cosine of the angle from the transducer's central axis
+    Built from userComputeBeamAngleResponse, or from the measured polar data in DIRECTIVITY_DATA_PATH if it's set
+    (measured data is always tabulated, whatever the DIRECTIVITY_MODE)
 
-def _convertTodB(amplitude_matrix):
+    Entry i holds the response at exactly the cosine -1 + i*(2/DIRECTIVITY_TABLE_SIZE), from -1 up to and including 1
+    Returns the table, and the slope from each entry to the next (0 for the last entry) for interpolating between them
+    """
+    if DIRECTIVITY_MODE not in ("table", "function"):
+        raise ValueError(f"Unknown directivity mode: {DIRECTIVITY_MODE}")
+    if DIRECTIVITY_MODE == "function" and DIRECTIVITY_DATA_PATH is None:
+        return None, None
+
+    angles = np.arccos(np.linspace(-1, 1, DIRECTIVITY_TABLE_SIZE+1))
+
+    if DIRECTIVITY_DATA_PATH is None:
+        response = userComputeBeamAngleResponse(angles.astype(_FLOAT_TYPE))
+    else:
+        # Columns: angle from the central axis (degrees), response
+        data = np.loadtxt(DIRECTIVITY_DATA_PATH, delimiter=",", comments="#", ndmin=2)
+        order = np.argsort(np.abs(data[:, 0]))
+        response = np.interp(angles, np.radians(np.abs(data[order, 0])), data[order, 1], right=np.nan)
+        if DIRECTIVITY_DATA_DB:
+            response = 10**(response/20)
+
+        # Taking the transducer to be silent beyond the largest measured angle
+        response = np.nan_to_num(response, nan=0)
+
+    response = np.asarray(response, dtype=np.float64)
+    slopes = np.append(np.diff(response), 0)
+
+    # The cells just off the central axis are extrapolated from the entries before them, so a response that's
+    # defined specially at exactly 0 (like the default function's zero-division guard) only applies exactly on the axis
+    # The last slope is 0, so a cosine of exactly 1 doesn't have to be clipped into the table
+    slopes[-2] = slopes[-3]
+
+    return response.astype(_FLOAT_TYPE), slopes.astype(_FLOAT_TYPE)
+
+def _cacheSize():
+    """
+    Returns the size in bytes of each CPU core's level 2 cache, or None if it can't be found on this platform
+    """
+    cache_dir = "/sys/devices/system/cpu/cpu0/cache"
+
+    try:
+        for index in os.listdir(cache_dir):
+            if not index.startswith("index"):
+                continue
+
+            with open(os.path.join(cache_dir, index, "level")) as f:
+                if f.read().strip() != "2":
+                    continue
+            with open(os.path.join(cache_dir, index, "size")) as f:
+                size = f.read().strip()
+
+            # Sizes are given like "2048K"
+            multiplier = {"K": 1024, "M": 1024**2}.get(size[-1], 1)
+            return int(size.rstrip("KM")) * multiplier
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+def _updateDerivedConstants():
+    """
+    (Re)computes every constant derived from the simulation settings
+    """
+    global _T_kel, _T_REL, _C, _WAVELENGTH, _PRESS_AMPLITUDE, _FLOAT_TYPE, _COMPLEX_TYPE
+    global _TRANSDUCER_PARAMETERS, _ATTENUATION_CONSTANT, _DIRECTIVITY_TABLE, _DIRECTIVITY_SLOPES, _BLOCK_CELLS
+
+    # Calculating tempearture-adjusted speed of sound
+    _T_kel = TEMPERATURE_DEG_C + _DEG_C_TO_KELVIN
+    _T_REL = _T_kel / (_DEG_C_TO_KELVIN + 20)
+    _C = 343.2*(_T_REL**0.5)
+    # Wavelength in MM
+    _WAVELENGTH = (_C/FREQUENCY)*1000
+    # Used for calculating absolute volume of ultrasound at every point
+    _PRESS_AMPLITUDE = 0.00002 * (10**(TRANSDUCER_TRANSMITTING_PRESSURE_LEVEL/20))
+    _FLOAT_TYPE = np.float32 if COMPRESS_FLOAT else np.float64
+    _COMPLEX_TYPE = np.complex64 if COMPRESS_FLOAT else np.complex128
+    # Transducer list, as (position vector in mm, central axis vector, phase offset in radians) tuples
+    _TRANSDUCER_PARAMETERS = [
+        (tuple(float(j) for j in i[0]), np.array(i[1], dtype=_FLOAT_TYPE), float(i[2])) for i in TRANSDUCERS
+    ]
+    # In Nepers/m
+    _ATTENUATION_CONSTANT = _computeAttenuationConstant()
+    # Beam angle response against the cosine of the angle from the central axis (None if it isn't tabulated)
+    _DIRECTIVITY_TABLE, _DIRECTIVITY_SLOPES = _buildDirectivityTable()
+    # Number of cells (times transducers) the kernel works on at once - sized so its working memory fits in the level 2 cache
+    if BLOCK_CELLS is not None:
+        _BLOCK_CELLS = BLOCK_CELLS
+    else:
+        cache_size = _cacheSize()
+        _BLOCK_CELLS = _DEFAULT_BLOCK_CELLS if cache_size is None else max(1024, cache_size // _KERNEL_BYTES_PER_CELL)
+
+_updateDerivedConstants()
+
+def configureSimulation(**settings):
+    """
+    Overrides simulation settings from SIM_CONFIG for this process, e.g. configureSimulation(PLOTSIZE=200, CPU_CORES=1)
+    Everything derived from the settings is recomputed, and the overrides are passed on to worker processes
+
+    Settings are also updated in SIM_CONFIG itself, so userComputeBeamAngleResponse sees them too
+    """
+    global _CONFIG_GENERATION
+
+    for name, value in settings.items():
+        globals()[name] = value
+        if hasattr(SIM_CONFIG, name):
+            setattr(SIM_CONFIG, name, value)
+
+    _CONFIG_OVERRIDES.update(settings)
+    _CONFIG_GENERATION += 1
+    _FIELD_TEMPLATE_CACHE.clear()
+    _updateDerivedConstants()
+    _stopProfileTracing()
+    _checkAngularSpectrumSource()
+
+def _convertTodB(amplitude_matrix, frequency=None, apply_weighting=True, quantise=False, out=None):
     """
     Logarithmically scales the amplitudes into decibel readings
     Adjusts for dB/dBA depending on what the user specified in the sim config
+    The dBA weighting is for the simulation FREQUENCY unless another frequency is given,
+    and is skipped if apply_weighting is False (when the amplitudes are already weighted)
+
+    amplitude_matrix can be the complex waves too, in which case their magnitudes are converted
+    If quantise is True, the readings are OUTPUT_QUANTISATION integers instead (written into out, if it's given)
+    They're converted block by block, so no full matrix of floats is needed
     """
+    if quantise:
+        if out is None:
+            out = np.empty(amplitude_matrix.shape, dtype=OUTPUT_QUANTISATION)
+
+        for index in _iterateBlocks(amplitude_matrix.shape):
+            block = amplitude_matrix[index]
+            if np.iscomplexobj(block):
+                block = np.abs(block)
+            quantiseDB(_convertTodB(block, frequency, apply_weighting), out=out[index])
+
+        return out
+
+    if np.iscomplexobj(amplitude_matrix):
+        amplitude_matrix = np.abs(amplitude_matrix)
+
     # If user wants results in dBA, need to compute the weighting for it
-    if dBA:
-        dba_weight = _computeDBAWeight()
+    if dBA and apply_weighting:
+        dba_weight = _computeDBAWeight(frequency)
     else:
         dba_weight = 0
 
@@ -112,257 +431,1907 @@ def _convertTodB(amplitude_matrix):
 
     return sim_matrix_db
 
-def _computeAttenuationFactors(dist_matrix):
+def getQuantisationScale(dtype):
+    """
+    Returns the dB per step of quantised dB results of the given dtype, or None for float results
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return None
+
+    return _QUANTISATION_SCALES_DB[dtype.name]
+
+def quantiseDB(sim_matrix_db, out=None):
+    """
+    Converts dB results into fixed-point integers of OUTPUT_QUANTISATION's type (or out's type, if it's given)
+    Levels are rounded to the nearest step, and clipped to the largest level the type can hold
+    Works through the results block by block, so only a block's worth of floats is needed at once
+    """
+    if out is None:
+        out = np.empty(sim_matrix_db.shape, dtype=OUTPUT_QUANTISATION)
+    scale = getQuantisationScale(out.dtype)
+    max_step = np.iinfo(out.dtype).max
+
+    for index in _iterateBlocks(sim_matrix_db.shape):
+        steps = np.multiply(sim_matrix_db[index], 1/scale, dtype=_FLOAT_TYPE)
+        np.rint(steps, out=steps)
+        np.minimum(steps, max_step, out=steps)
+        out[index] = steps
+
+    return out
+
+def dequantiseDB(sim_matrix_db):
+    """
+    Converts quantised dB results back into dB - float results are returned as they are
+    Used on whatever part of the results is needed (e.g. a slice being plotted), rather than the whole matrix
+    """
+    scale = getQuantisationScale(sim_matrix_db.dtype)
+    if scale is None:
+        return sim_matrix_db
+
+    return np.multiply(sim_matrix_db, scale, dtype=_FLOAT_TYPE)
+
+def _computeAttenuationFactors(dist_matrix, attenuation_constant=None):
     """
     Calculates and applies attenuation to the amplitude matrix
     Takes into account attenuation due to distance and atmospheric effects
+    Uses the simulation's attenuation constant (in Nepers/m) unless another one is given
     """
+    if attenuation_constant is None:
+        attenuation_constant = _ATTENUATION_CONSTANT
+
     # Converting from mm to m, can be adapted depending on desired sim resolution
     dist_matrix = np.divide(dist_matrix, _FLOAT_TYPE(1000))
 
     # Calculating atmospheric attenuation of sound
-    atmospheric_attenuation = np.multiply(dist_matrix, _FLOAT_TYPE(-_ATTENUATION_CONSTANT))
-    np.exp(atmospheric_attenuation, out=atmospheric_attenuation)
+    attenuated = np.multiply(dist_matrix, _FLOAT_TYPE(-attenuation_constant))
+    np.exp(attenuated, out=attenuated)
 
     # Calculating attenuation of sound due to distance
-    # Guards against zero division error
-    safe_distances = np.where(
-        dist_matrix == 0,
-        1,
-        dist_matrix
-    )
-    attenuated = np.where(
-        dist_matrix == 0,
-        0,
-        np.divide(atmospheric_attenuation, safe_distances)
-    )
+    # Guards against zero division error - there's no sound computed at the transducer's own position
+    at_transducer = dist_matrix == 0
+    np.divide(attenuated, dist_matrix, out=attenuated, where=~at_transducer)
+    attenuated[at_transducer] = 0
 
     return attenuated
 
-def _computeTransducerDistancesAngles(transducer_pos, transducer_axis):
+def getGridGeometry():
     """
-    Computes a matrix of the distances between the transducer and each point in the grid
-    Computes a matrix of the angles between the transducer central axis and each point in the grid
+    Returns the position of the grid's first cell (in mm), the side length of its cells (in mm),
+    and its number of cells along each of the x, y and z axes
     """
-    transducer_x, transducer_y, _ = transducer_pos
+    default_extent = PLOTSIZE * CELL_SIDE_LENGTH_MM
+    origin = GRID_ORIGIN_MM if GRID_ORIGIN_MM is not None else [0, 0, 0]
+    extent = GRID_EXTENT_MM if GRID_EXTENT_MM is not None else [default_extent] * 3
+    cell_size = GRID_CELL_SIZE_MM if GRID_CELL_SIZE_MM is not None else [CELL_SIDE_LENGTH_MM] * 3
 
-    # Shaping my x/y values into matrices of the right shape
-    x_vals = np.array(range(PLOTSIZE+1), dtype=_FLOAT_TYPE).reshape(1, PLOTSIZE+1)
-    y_vals = np.array(range(PLOTSIZE+1), dtype=_FLOAT_TYPE).reshape(PLOTSIZE+1, 1)
+    origin = [float(i) for i in origin]
+    cell_size = [float(i) for i in cell_size]
+    # One more cell than the number that fits in the extent, so both ends of the region are included
+    n_cells = [int(round(extent[i] / cell_size[i])) + 1 for i in range(3)]
 
-    # Calculating the x/y deltas between the transducer position and each point in the grid
-    delta_x_vals = x_vals - transducer_x
-    delta_y_vals = y_vals - transducer_y
+    return origin, cell_size, n_cells
 
-    # Combining to calculate distances
-    distance_sq = np.square(delta_x_vals) + np.square(delta_y_vals)
-    distances = np.sqrt(distance_sq)
+def _checkAngularSpectrumSource():
+    """
+    Checks ANGULAR_SPECTRUM_SOURCE_INDEX is one of the grid's z-planes (or None)
+    """
+    n_planes = getGridGeometry()[2][2]
 
-    # Calculating dot product matrix
-    dot_product_matrix = delta_x_vals*transducer_axis[0] + delta_y_vals*transducer_axis[1]
-    axis_vec_length = np.linalg.norm(transducer_axis)
+    if ANGULAR_SPECTRUM_SOURCE_INDEX is not None and not 0 <= ANGULAR_SPECTRUM_SOURCE_INDEX < n_planes:
+        raise ValueError(
+            f"ANGULAR_SPECTRUM_SOURCE_INDEX must be None or a z-plane index from 0 to {n_planes-1}: "
+            f"{ANGULAR_SPECTRUM_SOURCE_INDEX}"
+        )
 
-    # Calculating the cosine of the angles as a matrix
-    angles_cosine = np.divide(dot_product_matrix, axis_vec_length)
-    # Guarding against zero-division errors
-    # IDEA: Only modify transducer position cell in distances, as that's the only one == 0
-    safe_distances = np.where(distances == 0, 1, distances)
-    np.divide(angles_cosine, safe_distances, out=angles_cosine)
+def _gridAxes(n_dims):
+    """
+    Returns the coordinates (in mm) of the grid cells along each axis of the simulation matrix
+    Simulation matrices are indexed [y, x] in 2D, and [y, x, z] in 3D
+    """
+    origin, cell_size, n_cells = getGridGeometry()
 
-    # Keeping cosine values in range
-    np.clip(angles_cosine, -1, 1, out=angles_cosine)
+    return tuple(
+        _FLOAT_TYPE(origin[i]) + np.arange(n_cells[i], dtype=_FLOAT_TYPE) * _FLOAT_TYPE(cell_size[i])
+        for i in _MATRIX_AXIS_COMPONENTS[:n_dims]
+    )
 
-    # Calculating the angles as a matrix
-    angles = np.arccos(angles_cosine)
+def _iterateBlocks(shape):
+    """
+    Splits a matrix of the given shape into blocks of at most BLOCK_CELLS cells (or as many as fit in the cache, if it's None)
+    Yields a tuple of slices for each block, so each block is a contiguous chunk of the matrix
+    """
+    # Finding how many of the trailing axes can be kept whole within a block
+    whole_axis = len(shape)
+    inner_cells = 1
+    while whole_axis > 0 and inner_cells*shape[whole_axis-1] <= _BLOCK_CELLS:
+        whole_axis -= 1
+        inner_cells *= shape[whole_axis]
+
+    if whole_axis == 0:
+        yield (slice(None),) * len(shape)
+        return
+
+    # The axis before those is chunked, and any axes before that are stepped through one at a time
+    chunk_axis = whole_axis - 1
+    step = max(1, _BLOCK_CELLS // inner_cells)
+    trailing = (slice(None),) * (len(shape) - whole_axis)
+
+    for outer in np.ndindex(*shape[:chunk_axis]):
+        leading = tuple(slice(i, i+1) for i in outer)
+        for start in range(0, shape[chunk_axis], step):
+            yield leading + (slice(start, start+step),) + trailing
+
+def _blockCoordinates(axes_values, index):
+    """
+    Shapes the coordinates of a block of the grid so that they broadcast against the block
+    Returns the x, y and z coordinates - z is None for 2D simulations
+    """
+    n_dims = len(axes_values)
+    coordinates = []
+    for axis in range(n_dims):
+        shape = [1] * n_dims
+        shape[axis] = -1
+        coordinates.append(axes_values[axis][index[axis]].reshape(shape))
 
-    # Converting from distance in terms of cells to distance in mm
-    np.multiply(distances, CELL_SIDE_LENGTH_MM, out=distances)
+    y_vals, x_vals = coordinates[0], coordinates[1]
+    z_vals = coordinates[2] if n_dims == 3 else None
 
-    return distances, angles
+    return x_vals, y_vals, z_vals
 
-def _computeTransducerDistancesAngles3D(transducer_pos, transducer_axis):
+def _transducerBatch(transducers, n_dims):
     """
-    Computes a matrix of the 3D distances between the transducer and each point in the grid
-    Computes a matrix of the 3D angles between the transducer central axis and each point in the grid
+    Stacks a batch of transducers into arrays, so their waves can be evaluated together
+    Returns their x/y/z positions (in mm), x/y/z unit central axis vectors and phase offsets - each shaped to broadcast
+    against a block of the grid with n_dims axes, with the transducers along an extra first axis
     """
-    transducer_x, transducer_y, transducer_z = transducer_pos
+    batch_shape = (len(transducers),) + (1,)*n_dims
+    positions = np.array([i[0] for i in transducers], dtype=_FLOAT_TYPE)
+    unit_axes = np.array([i[1] / np.linalg.norm(i[1]) for i in transducers], dtype=_FLOAT_TYPE)
+    phases = np.array([i[2] for i in transducers], dtype=_FLOAT_TYPE)
+
+    return (
+        tuple(positions[:, i].reshape(batch_shape) for i in range(3)),
+        tuple(unit_axes[:, i].reshape(batch_shape) for i in range(3)),
+        phases.reshape(batch_shape)
+    )
+
+def _computeBlockGeometry(batch, x_vals, y_vals, z_vals):
+    """
+    Computes the distance (in mm) from each transducer in a batch to each cell in a block of the grid,
+    and the cosine of the angle between the transducer's central axis and each cell
+    Both have the transducers along their first axis, followed by the block's axes
 
-    # Shaping my x/y values into matrices of the right shape
-    x_vals = np.array(range(PLOTSIZE+1), dtype=_FLOAT_TYPE).reshape(1, PLOTSIZE+1, 1)
-    y_vals = np.array(range(PLOTSIZE+1), dtype=_FLOAT_TYPE).reshape(PLOTSIZE+1, 1, 1)
-    z_vals = np.array(range(PLOTSIZE+1), dtype=_FLOAT_TYPE).reshape(1, 1, PLOTSIZE+1)
+    batch is from _transducerBatch(), and x_vals/y_vals/z_vals are the coordinates (in mm) of the block's cells,
+    shaped to broadcast against the block
+    z_vals is None for 2D simulations, in which case the transducers' z positions are ignored
+    """
+    (transducer_x, transducer_y, transducer_z), (axis_x, axis_y, axis_z), _ = batch
 
-    # Calculating the x/y deltas between the transducer position and each point in the grid
+    # Calculating the x/y/z deltas between the transducer positions and each point in the block
     delta_x_vals = x_vals - transducer_x
     delta_y_vals = y_vals - transducer_y
-    delta_z_vals = z_vals - transducer_z
 
-    # Combining to calculate distances
-    distance_sq = np.square(delta_x_vals) + np.square(delta_y_vals) + np.square(delta_z_vals)
-    distances = np.sqrt(distance_sq)
+    # Combining to calculate distances, and the dot product with the transducers' central axes
+    distances = np.square(delta_x_vals) + np.square(delta_y_vals)
+    angles_cosine = delta_x_vals*axis_x + delta_y_vals*axis_y
+    if z_vals is not None:
+        delta_z_vals = z_vals - transducer_z
+        distances = distances + np.square(delta_z_vals)
+        angles_cosine = angles_cosine + delta_z_vals*axis_z
+    np.sqrt(distances, out=distances)
+
+    # Calculating the cosine of the angles
+    # The dot product is already zero at the transducer position, so that cell is skipped to avoid zero-division
+    np.divide(angles_cosine, distances, out=angles_cosine, where=distances != 0)
+    np.clip(angles_cosine, -1, 1, out=angles_cosine)
+
+    return distances, angles_cosine
 
-    # Calculating dot product matrix
-    dot_product_matrix = delta_x_vals*transducer_axis[0] + delta_y_vals*transducer_axis[1] + delta_z_vals*transducer_axis[2]
-    axis_vec_length = np.linalg.norm(transducer_axis)
+def _computeBeamResponse(angles_cosine):
+    """
+    Computes the beam angle response at each cell, from the cosine of its angle from the transducer's central axis
+    Overwrites angles_cosine (the response may be written into it)
+    """
+    if _DIRECTIVITY_TABLE is None:
+        return userComputeBeamAngleResponse(np.arccos(angles_cosine, out=angles_cosine))
 
-    # Calculating the cosine of the angles as a matrix
-    angles_cosine = np.divide(dot_product_matrix, axis_vec_length)
+    # Position of each cosine in the table, and the index of the entry at or below it
+    np.add(angles_cosine, _FLOAT_TYPE(1), out=angles_cosine)
+    np.multiply(angles_cosine, _FLOAT_TYPE(DIRECTIVITY_TABLE_SIZE/2), out=angles_cosine)
+    indices = angles_cosine.astype(np.int32)
 
-    # Guarding against zero-division errors
-    # IDEA: Only modify transducer position cell in distances, as that's the only one == 0
-    safe_distances = np.where(distances == 0, 1, distances)
-    np.divide(angles_cosine, safe_distances, out=angles_cosine)
+    # Interpolating linearly between the entries either side
+    np.subtract(angles_cosine, indices, out=angles_cosine)
+    np.multiply(angles_cosine, np.take(_DIRECTIVITY_SLOPES, indices), out=angles_cosine)
 
-    # Keeping cosine values in range
-    np.clip(angles_cosine, -1, 1, out=angles_cosine)
+    return np.add(angles_cosine, np.take(_DIRECTIVITY_TABLE, indices), out=angles_cosine)
 
-    # Calculating the angles as a matrix
-    angles = np.arccos(angles_cosine)
+def _accumulateTransducerBlock(batch, x_vals, y_vals, z_vals, out, profile_positions=(None,)):
+    """
+    Fused kernel - adds the complex waves produced by a batch of transducers to a block of the grid, in place
+    batch is from _transducerBatch(), and the stages are profiled against the batch's profile_positions (if given)
+
+    x_vals/y_vals/z_vals are the coordinates (in mm) of the block's cells, shaped to broadcast against the block
+    z_vals is None for 2D simulations
+
+    Every temporary is the size of the block times the size of the batch rather than the whole grid,
+    so the working set stays in the CPU cache
+    """
+    transducer_phases = batch[2]
 
-    # Converting from distance in terms of cells to distance in mm
-    np.multiply(distances, CELL_SIDE_LENGTH_MM, out=distances)
+    with _profileStage("distances_angles", profile_positions):
+        distances, angles_cosine = _computeBlockGeometry(batch, x_vals, y_vals, z_vals)
 
-    return distances, angles
+    with _profileStage("beam_response", profile_positions):
+        beam_angle_factors = _computeBeamResponse(angles_cosine)
 
-def _generateTransducerMatrix2D(transducer_no):
+    with _profileStage("attenuation", profile_positions):
+        # Computing the wave amplitude at each point in the block
+        amplitudes = _computeAttenuationFactors(distances)
+        np.multiply(amplitudes, beam_angle_factors, out=amplitudes)
+        np.multiply(amplitudes, _FLOAT_TYPE(_PRESS_AMPLITUDE * R0), out=amplitudes)
+
+    with _profileStage("phasor", profile_positions):
+        # Computing phase offset in radians at each point in the block, including the transducers' phase offsets
+        phase_offsets = np.multiply(distances, _FLOAT_TYPE(2*np.pi/_WAVELENGTH), out=distances)
+        np.add(phase_offsets, transducer_phases, out=phase_offsets)
+
+        # Summing the batch's wave phasors, and adding them straight onto the real and imaginary parts of the block
+        # einsum scales and sums over the transducers in one pass, reusing the angles memory as it's no longer needed
+        phasor_part = np.cos(phase_offsets, out=angles_cosine)
+        np.add(out.real, np.einsum("i...,i...->...", phasor_part, amplitudes), out=out.real)
+
+        np.sin(phase_offsets, out=phasor_part)
+        np.add(out.imag, np.einsum("i...,i...->...", phasor_part, amplitudes), out=out.imag)
+
+def _batchSize(n_cells, n_transducers):
     """
-    Generates a matrix showing the volumes produced due to the single transducer at each point in the grid
+    Number of transducers evaluated together against each block of a grid of n_cells cells
+    Blocks hold up to BLOCK_CELLS cells, so when the grid is smaller than that the transducers are batched until
+    each block's working set (cells x transducers) fills the cache again - keeping NumPy's per-call overhead
+    negligible, even for small grids with hundreds of transducers
     """
-    # Creating an initial uniform sound amplitude matrix
-    amplitude_matrix = np.full(
-        (PLOTSIZE+1, PLOTSIZE+1),
-        _PRESS_AMPLITUDE * R0,
-        dtype=_FLOAT_TYPE
-    )
+    return max(1, min(n_transducers, _BLOCK_CELLS // max(1, min(n_cells, _BLOCK_CELLS))))
+
+def _accumulateTransducers(out, axes_values, transducers):
+    """
+    Adds the complex waves of the given transducers to the matrix out, one cache-sized block at a time
+    axes_values holds the coordinates (in mm) along each axis of out
+    """
+    batch_size = _batchSize(out.size, len(transducers))
+    batches = [
+        (_transducerBatch(transducers[i:i+batch_size], out.ndim), [j[0] for j in transducers[i:i+batch_size]])
+        for i in range(0, len(transducers), batch_size)
+    ]
+
+    for index in _iterateBlocks(out.shape):
+        x_vals, y_vals, z_vals = _blockCoordinates(axes_values, index)
+        block = out[index]
+
+        for batch, profile_positions in batches:
+            _accumulateTransducerBlock(batch, x_vals, y_vals, z_vals, block, profile_positions)
+
+def _groupTemplateTransducers(transducers, n_dims):
+    """
+    Splits the transducers into those that can be stamped from a field template, and those that can't
+
+    A transducer's wave only depends on the offset from its position (apart from its phase),
+    so every transducer sitting exactly on a grid cell can share a template with the others pointing the same way
+    Returns the list of transducers to compute directly, and a dict of {axis vector: [(grid cell, phase), ...]}
+    """
+    direct_transducers = []
+    template_groups = {}
+
+    # Grid origin and cell sizes, in the same [y, x, z] order as the simulation matrix axes
+    origin, cell_size, _ = getGridGeometry()
+    components = list(_MATRIX_AXIS_COMPONENTS[:n_dims])
+    origin = np.array(origin)[components]
+    cell_size = np.array(cell_size)[components]
+
+    for transducer in transducers:
+        position, transducer_axis, transducer_phase = transducer
+
+        # Position in cells from the grid's first cell
+        cell = (np.array(position)[components] - origin) / cell_size
+        if np.allclose(cell, np.round(cell), rtol=0, atol=1e-6):
+            key = tuple(float(i) for i in transducer_axis)
+            template_groups.setdefault(key, []).append((np.round(cell).astype(int), transducer_phase))
+        else:
+            direct_transducers.append(transducer)
+
+    return direct_transducers, template_groups
+
+def _getFieldTemplate(transducer_axis, low, high):
+    """
+    Returns a zero-phase field template for a transducer with the given axis, computed on an oversized grid
+    low/high are the (inclusive) offsets from the transducer, in cells, that the template has to cover
 
-    # Computing all required bits to determine sound wave amplitude at each point in the grid
-    # Then applying these to the amplitude matrix
-    dist_matrix, angle_matrix = _computeTransducerDistancesAngles(
-        _TRANSDUCER_POS_VECTORS[transducer_no],
-        _TRANSDUCER_AXIS_VECTORS[transducer_no]
+    Templates are cached, and only recomputed if a larger one is needed
+    """
+    cell_size = tuple(getGridGeometry()[1][i] for i in _MATRIX_AXIS_COMPONENTS[:len(low)])
+    key = (transducer_axis, cell_size)
+
+    if key in _FIELD_TEMPLATE_CACHE:
+        cached_low, template = _FIELD_TEMPLATE_CACHE[key]
+        cached_high = cached_low + np.array(template.shape) - 1
+
+        if np.all(cached_low <= low) and np.all(cached_high >= high):
+            return cached_low, template
+
+        # Growing the template so it still covers everything it did before
+        low = np.minimum(low, cached_low)
+        high = np.maximum(high, cached_high)
+        del _FIELD_TEMPLATE_CACHE[key], template
+
+    _logger(f"Computing field template for axis {transducer_axis}")
+    axes_values = tuple(
+        np.arange(low[i], high[i]+1, dtype=_FLOAT_TYPE) * _FLOAT_TYPE(cell_size[i]) for i in range(len(low))
     )
-    attenuation_factors = _computeAttenuationFactors(dist_matrix)
-    beam_angle_factors = userComputeBeamAngleResponse(angle_matrix)
+    transducer = ((0.0, 0.0, 0.0), np.array(transducer_axis, dtype=_FLOAT_TYPE), 0.0)
+    template = _computeComplexField(axes_values, [transducer], np.copy)
+
+    _FIELD_TEMPLATE_CACHE[key] = (low, template)
+
+    return low, template
+
+def _resolveSlices(index, shape):
+    """
+    Converts a tuple of slices into explicit slice(start, stop) objects for an array of the given shape
+    """
+    return tuple(slice(*i.indices(n)[:2]) for i, n in zip(index, shape))
+
+def _stampFieldTemplates(sim_matrix, template_groups, box_start=0):
+    """
+    Adds the waves of every templated transducer to the simulation matrix
+    Each transducer's wave is a shifted slice of its template, rotated by the transducer's phase offset
+
+    box_start is the grid cell of the matrix's first cell, if it only covers part of the grid
+    """
+    n_cells = np.array(sim_matrix.shape)
+
+    for transducer_axis, group in template_groups.items():
+        cells = np.array([cell for cell, _ in group])
+        low, template = _getFieldTemplate(
+            transducer_axis,
+            box_start - cells.max(axis=0),
+            box_start + n_cells - 1 - cells.min(axis=0)
+        )
+
+        for cell, transducer_phase in group:
+            # Index into the template of the matrix's first cell
+            shift = box_start - cell - low
+            phasor = _COMPLEX_TYPE(np.exp(1j*transducer_phase))
+
+            for index in _iterateBlocks(sim_matrix.shape):
+                template_index = tuple(
+                    slice(i.start+shift[axis], i.stop+shift[axis]) for axis, i in enumerate(_resolveSlices(index, n_cells))
+                )
+                if transducer_phase == 0:
+                    sim_matrix[index] += template[template_index]
+                else:
+                    sim_matrix[index] += template[template_index] * phasor
+
+def _openTarget(target):
+    """
+    Returns the matrix a worker adds its results into
+    Worker threads are given the matrix itself, worker processes the (name, shape) of the shared memory holding it
+    """
+    global _SHARED_MEMORY
+
+    if isinstance(target, np.ndarray):
+        return target
+
+    shm_name, shape = target
+    _SHARED_MEMORY = shared_memory.SharedMemory(name=shm_name)
+
+    return np.ndarray(shape, dtype=_COMPLEX_TYPE, buffer=_SHARED_MEMORY.buf)
+
+def _closeTarget(target):
+    """
+    Detaches a worker process from the shared memory - every view of it has to be deleted first
+    """
+    if not isinstance(target, np.ndarray):
+        _SHARED_MEMORY.close()
+
+def _accumulateTransducerMatrix(task):
+    """
+    Worker function - computes a single transducer's wave matrix, then adds it into the result matrix
+    task is a (grid axes values, transducer, result matrix target) tuple
+    Returns the worker's profiling records
+    """
+    axes_values, transducer, target = task
+    sim_matrix = _openTarget(target)
+    lock = _THREAD_LOCK if isinstance(target, np.ndarray) else _SHARED_LOCK
+
+    _logger(f"Started computing transducer matrix at {transducer[0]}")
+    complex_wave_amplitudes = np.zeros(sim_matrix.shape, dtype=_COMPLEX_TYPE)
+    _accumulateTransducers(complex_wave_amplitudes, axes_values, [transducer])
+
+    with _profileStage("transfer", [transducer[0]]), lock:
+        np.add(sim_matrix, complex_wave_amplitudes, out=sim_matrix)
+    _logger(f"Computed matrix at {transducer[0]}")
+
+    del sim_matrix
+    _closeTarget(target)
+
+    return _takeProfile()
+
+def _accumulateSlab(task):
+    """
+    Worker function - adds the contributions of every transducer to a slab of rows of the result matrix
+    task is a ((start, stop) rows, grid axes values, transducers, result matrix target) tuple
+    Each slab is owned by a single worker, so no locking is needed
+    Returns the worker's profiling records
+    """
+    (start, stop), axes_values, transducers, target = task
+    axes_values = (axes_values[0][start:stop],) + tuple(axes_values[1:])
+    sim_matrix = _openTarget(target)
+
+    _logger(f"Started computing slab {start}-{stop}")
+    _accumulateTransducers(sim_matrix[start:stop], axes_values, transducers)
+    _logger(f"Computed slab {start}-{stop}")
+
+    del sim_matrix
+    _closeTarget(target)
+
+    return _takeProfile()
+
+def _computeSlabs(n_rows):
+    """
+    Splits the rows of the grid into (start, stop) slabs to be shared out between the CPU cores
+    """
+    n_slabs = min(n_rows, CPU_CORES*_SLABS_PER_CORE)
+    bounds = np.linspace(0, n_rows, n_slabs+1).astype(int)
+
+    return [(int(bounds[i]), int(bounds[i+1])) for i in range(n_slabs)]
+
+def _initPoolWorker(overrides, lock):
+    """
+    Process pool initialiser - applies any settings overridden in the parent process
+    """
+    global _SHARED_LOCK, _PROCESS_POOL, _THREAD_POOL
+
+    if overrides:
+        configureSimulation(**overrides)
+    _SHARED_LOCK = lock
+    # Copied from the parent process, but they can't be used from a worker
+    _PROCESS_POOL = None
+    _THREAD_POOL = None
+
+def _processPool():
+    """
+    Returns the long-lived process pool, (re)starting it if CPU_CORES or any setting has changed since it was started
+    """
+    global _PROCESS_POOL, _PROCESS_POOL_KEY
+
+    key = (CPU_CORES, _CONFIG_GENERATION)
+    if _PROCESS_POOL is None or _PROCESS_POOL_KEY != key:
+        shutdownWorkerPools()
+
+        _logger(f"Starting {CPU_CORES} worker processes")
+        _PROCESS_POOL = Pool(processes=CPU_CORES, initializer=_initPoolWorker, initargs=(_CONFIG_OVERRIDES, Lock()))
+        _PROCESS_POOL_KEY = key
+
+    return _PROCESS_POOL
+
+def _threadPool():
+    """
+    Returns the long-lived thread pool, (re)starting it if CPU_CORES has changed since it was started
+    Threads read the settings straight from this module, so don't need restarting when they change
+    """
+    global _THREAD_POOL, _THREAD_POOL_SIZE
+
+    if _THREAD_POOL is None or _THREAD_POOL_SIZE != CPU_CORES:
+        if _THREAD_POOL is not None:
+            _THREAD_POOL.shutdown()
+
+        _THREAD_POOL = ThreadPoolExecutor(max_workers=CPU_CORES, thread_name_prefix="simulation")
+        _THREAD_POOL_SIZE = CPU_CORES
+
+    return _THREAD_POOL
+
+def shutdownWorkerPools():
+    """
+    Stops the long-lived worker processes and threads, freeing their memory
+    They're started again the next time they're needed, and stopped automatically when the program exits
+    """
+    global _PROCESS_POOL, _THREAD_POOL
+
+    # Threads are stopped before processes are started too, as forking a process with running threads isn't safe
+    if _THREAD_POOL is not None:
+        _THREAD_POOL.shutdown()
+        _THREAD_POOL = None
+
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.close()
+        _PROCESS_POOL.join()
+        _PROCESS_POOL = None
+
+atexit.register(shutdownWorkerPools)
+
+def _availableMemory():
+    """
+    Returns the free memory in bytes, or None if it can't be found on this platform
+    """
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _chooseExecutor(n_cells, n_transducers):
+    """
+    Picks how to run a computation of n_cells grid cells and n_transducers transducers - "serial", "thread" or "process"
+    EXECUTOR sets this directly (although runs with one CPU core are always serial), or with "auto":
+        serial -> if there's so little work that handing it out to workers would take longer than the work itself
+        process -> for lots of work (or if the process pool is already running), as its start-up cost is then
+                   negligible and it isn't held back by the GIL - as long as the extra processes fit in the free memory
+        thread -> otherwise, as threads start instantly and share the result matrix without any copying
+    While PROFILE_STAGES is True, runs that would use threads are serial instead
+    """
+    if EXECUTOR not in ("auto", "serial", "thread", "process"):
+        raise ValueError(f"Unknown executor: {EXECUTOR}")
+
+    # tracemalloc and the profiling records are shared by every thread in a process,
+    # so threads profiled at the same time would mix up each other's time and memory
+    thread_executor = "serial" if PROFILE_STAGES else "thread"
+
+    if CPU_CORES == 1:
+        return "serial"
+    if EXECUTOR == "thread":
+        return thread_executor
+    if EXECUTOR != "auto":
+        return EXECUTOR
+
+    updates = n_cells * n_transducers
+    if updates < _AUTO_SERIAL_UPDATES:
+        return "serial"
+
+    pool_running = _PROCESS_POOL is not None and _PROCESS_POOL_KEY == (CPU_CORES, _CONFIG_GENERATION)
+    if pool_running or updates > _AUTO_PROCESS_UPDATES:
+        free_memory = _availableMemory()
+        if free_memory is None or CPU_CORES*_PROCESS_WORKER_BYTES < free_memory:
+            return "process"
+
+    return thread_executor
+
+def _mapTasks(worker_function, tasks, executor):
+    """
+    Runs the worker function over every task with the given executor, returning an iterator over the results
+    Results from worker threads/processes are returned in the order they finish
+    """
+    if executor == "serial":
+        return map(worker_function, tasks)
+
+    if executor == "thread":
+        futures = [_threadPool().submit(worker_function, task) for task in tasks]
+        return (future.result() for future in as_completed(futures))
+
+    return _processPool().imap_unordered(worker_function, tasks)
+
+def _runSharedAccumulation(shape, worker_function, tasks, reduction, executor):
+    """
+    Runs the worker function over every task with a pool of worker threads or processes
+    Each worker adds its results straight into a single complex matrix - shared between threads directly, or
+    held in shared memory for processes - so nothing has to be pickled back to the parent process
+    Each task is given the result matrix's target as its last item
+
+    The reduction function is applied to the result matrix (before any shared memory is released),
+    and its result is returned
+    """
+    if executor == "thread":
+        sim_matrix = np.zeros(shape, dtype=_COMPLEX_TYPE)
+
+        for records in _mapTasks(worker_function, [task + (sim_matrix,) for task in tasks], executor):
+            _mergeProfile(records)
+
+        return reduction(sim_matrix)
+
+    nbytes = int(np.prod(shape)) * np.dtype(_COMPLEX_TYPE).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+
+    try:
+        sim_matrix = np.ndarray(shape, dtype=_COMPLEX_TYPE, buffer=shm.buf)
+        sim_matrix.fill(0)
+
+        for records in _mapTasks(worker_function, [task + ((shm.name, shape),) for task in tasks], executor):
+            _mergeProfile(records)
+
+        result = reduction(sim_matrix)
+        # The shared memory can't be closed while a view of it still exists
+        del sim_matrix
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return result
+
+def _computeComplexField(axes_values, transducers, reduction):
+    """
+    Sums the complex waves from the given transducers across a grid with the given axes values (in mm)
+    Runs in serial or in parallel depending on CPU_CORES, EXECUTOR and PARALLEL_MODE
+
+    The reduction function is applied to the summed complex matrix, and its result is returned
+    """
+    shape = tuple(len(i) for i in axes_values)
+    executor = _chooseExecutor(int(np.prod(shape)), len(transducers))
+
+    if executor == "serial":
+        sim_matrix = np.zeros(shape, dtype=_COMPLEX_TYPE)
+
+        _logger(f"Started computing {len(transducers)} transducer matrices")
+        _accumulateTransducers(sim_matrix, axes_values, transducers)
+        _logger("Computed matrices")
+
+        return reduction(sim_matrix)
+
+    # Workers sum their matrices into shared memory, the reduction is applied before it's released
+    if PARALLEL_MODE == "slab":
+        tasks = [(rows, axes_values, transducers) for rows in _computeSlabs(shape[0])]
+        return _runSharedAccumulation(shape, _accumulateSlab, tasks, reduction, executor)
 
-    # Applying those two calculations to the amplitudes
-    np.multiply(attenuation_factors, beam_angle_factors, out=attenuation_factors)
-    np.multiply(amplitude_matrix, attenuation_factors, out=amplitude_matrix)
+    tasks = [(axes_values, transducer) for transducer in transducers]
+    return _runSharedAccumulation(shape, _accumulateTransducerMatrix, tasks, reduction, executor)
 
-    # Computing phase offset in radians at each point in the grid
-    phase_offsets = np.divide(dist_matrix, _WAVELENGTH)
-    np.multiply(phase_offsets, 2*np.pi, out=phase_offsets)
+def _detectMirrorSymmetries(transducers, axes_values):
+    """
+    Finds the grid axes that the transducer array is mirror-symmetric along
+    The array is symmetric along an axis if reflecting every transducer's position and central axis in a plane
+    gives back the same array (with the same phase offsets) - e.g. planar arrays, reflected in their own plane
 
-    # Adding on transducer phase offset
-    np.add(phase_offsets, TRANSDUCERS[transducer_no][2], out=phase_offsets)
+    Only planes through a grid cell, or halfway between two cells, are used
+    Returns a dict of {matrix axis: index of the mirror plane, in cells}
+    """
+    if not transducers:
+        return {}
+
+    # Columns: x, y, z, axis x, axis y, axis z, phase offset
+    parameters = np.array([
+        list(position) + list(transducer_axis / np.linalg.norm(transducer_axis)) + [transducer_phase % (2*np.pi)]
+        for position, transducer_axis, transducer_phase in transducers
+    ])
+    # Transducers' z positions are ignored in 2D simulations
+    if len(axes_values) == 2:
+        parameters[:, 2] = 0
+    symmetries = {}
+
+    for matrix_axis, component in enumerate(_MATRIX_AXIS_COMPONENTS[:len(axes_values)]):
+        if len(axes_values[matrix_axis]) < 2:
+            continue
+
+        # A symmetric array is always symmetric about its mean position
+        centre = parameters[:, component].mean()
+        mirror_index = (centre - axes_values[matrix_axis][0]) / (axes_values[matrix_axis][1] - axes_values[matrix_axis][0])
+
+        if not np.isclose(2*mirror_index, round(2*mirror_index), rtol=0, atol=1e-6):
+            continue
+        if not 0 <= mirror_index <= len(axes_values[matrix_axis]) - 1:
+            continue
+
+        reflected = parameters.copy()
+        reflected[:, component] = 2*centre - reflected[:, component]
+        reflected[:, component+3] = -reflected[:, component+3]
+
+        # Every reflected transducer has to match a transducer in the array
+        differences = np.abs(reflected[:, np.newaxis, :] - parameters[np.newaxis, :, :])
+        differences[:, :, 6] = np.minimum(differences[:, :, 6], 2*np.pi - differences[:, :, 6])
+        if np.all(np.any(np.all(differences < 1e-6, axis=2), axis=1)):
+            symmetries[matrix_axis] = round(2*mirror_index) / 2
+
+    return symmetries
+
+def _mirrorSymmetricHalves(matrix, symmetries, box):
+    """
+    Fills in the parts of the matrix outside the computed box by mirroring it, for each symmetry in turn
+    box is the tuple of slices that has been computed
+    """
+    done = list(box)
 
-    # Using those to calculate wave phasors
-    complex_wave_amplitudes = np.exp(phase_offsets*_COMPLEX_TYPE(1j))
+    for matrix_axis, mirror_index in symmetries.items():
+        n_cells = matrix.shape[matrix_axis]
+        computed = np.arange(n_cells)[box[matrix_axis]]
+        missing = np.setdiff1d(np.arange(n_cells), computed)
+        mirrored = (2*mirror_index - missing).astype(int)
 
-    # Applying wave amplitude (magnitude) to the wave phasor representation
-    np.multiply(amplitude_matrix, complex_wave_amplitudes, out=complex_wave_amplitudes)
+        target = list(done)
+        source = list(done)
+        target[matrix_axis] = missing
+        source[matrix_axis] = mirrored
+        matrix[tuple(target)] = matrix[tuple(source)]
 
-    return complex_wave_amplitudes
+        done[matrix_axis] = slice(None)
 
-def _generateTransducerMatrix3D(transducer_no):
+def _simulateAmplitudes(n_dims, output="amplitude"):
+    """
+    Sums the complex waves from every transducer across the grid, then takes the absolute wave amplitude at each point
+    output selects what's returned: "amplitude" -> wave amplitudes, "complex" -> summed complex waves,
+    "quantised" -> OUTPUT_QUANTISATION dB results, converted block by block without a full matrix of amplitudes
+
+    If USE_SYMMETRY is True and the transducer array is mirror-symmetric along any axes, only the unique
+    half (or quarter, eighth) of the grid is computed, and the rest is filled in by mirroring it
+    """
+    axes_values = _gridAxes(n_dims)
+    shape = tuple(len(i) for i in axes_values)
+    transducers = _TRANSDUCER_PARAMETERS
+    template_groups = {}
+
+    # Working out which part of the grid has to be computed
+    symmetries = _detectMirrorSymmetries(transducers, axes_values) if USE_SYMMETRY else {}
+    box = [slice(None)] * n_dims
+    for matrix_axis, mirror_index in symmetries.items():
+        # Computing the larger side of the mirror plane, so the whole of the other side is a reflection of it
+        if mirror_index <= (shape[matrix_axis] - 1) / 2:
+            box[matrix_axis] = slice(int(np.floor(mirror_index)), None)
+        else:
+            box[matrix_axis] = slice(0, int(np.ceil(mirror_index)) + 1)
+    box = _resolveSlices(tuple(box), shape)
+    box_start = np.array([i.start for i in box])
+    if symmetries:
+        _logger(f"Mirror symmetry found along matrix axes {list(symmetries)}, computing {[i.stop-i.start for i in box]} cells")
+
+    if USE_FIELD_TEMPLATES:
+        transducers, template_groups = _groupTemplateTransducers(transducers, n_dims)
+
+    def reduction(sim_matrix):
+        if template_groups:
+            with _profileStage("templates"):
+                _stampFieldTemplates(sim_matrix, template_groups, box_start)
+        with _profileStage("reduction"):
+            # The complex wave is copied, as the matrix may be in shared memory that's released after the reduction
+            if not symmetries:
+                if output == "quantised":
+                    return _convertTodB(sim_matrix, quantise=True)
+                return np.copy(sim_matrix) if output == "complex" else np.abs(sim_matrix)
+
+            output_types = {"amplitude": _FLOAT_TYPE, "complex": _COMPLEX_TYPE, "quantised": OUTPUT_QUANTISATION}
+            amplitude_matrix = np.empty(shape, dtype=output_types[output])
+            if output == "quantised":
+                _convertTodB(sim_matrix, quantise=True, out=amplitude_matrix[box])
+            elif output == "complex":
+                amplitude_matrix[box] = sim_matrix
+            else:
+                np.abs(sim_matrix, out=amplitude_matrix[box])
+            _mirrorSymmetricHalves(amplitude_matrix, symmetries, box)
+            return amplitude_matrix
+
+    box_axes_values = tuple(values[i] for values, i in zip(axes_values, box))
+
+    return _computeComplexField(box_axes_values, transducers, reduction)
+
+def _taperWindow(length, margin):
     """
-    Generates a 3D matrix showing the volumes produced due to the single transducer at each point in the cube
+    Returns a 1D window of the given length - 1 in the middle, with a raised cosine down to 0 over margin cells at each end
     """
-    _logger(f"Started computing transducer matrix {transducer_no}")
-    # Creating an initial uniform sound amplitude matrix
-    amplitude_matrix = np.full(
-        (PLOTSIZE+1, PLOTSIZE+1, PLOTSIZE+1),
-        _PRESS_AMPLITUDE * R0,
-        dtype=_FLOAT_TYPE
+    window = np.ones(length, dtype=_FLOAT_TYPE)
+    if margin > 0:
+        ramp = 0.5 - 0.5*np.cos(np.pi*np.arange(margin)/margin)
+        window[:margin] = ramp
+        window[-margin:] = ramp[::-1]
+
+    return window
+
+def _simulateAmplitudesAngularSpectrum():
+    """
+    Computes the absolute wave amplitude across the 3D grid with the angular spectrum method
+
+    The complex wave is computed directly on a single source plane (at constant z) past the transducers.
+    It's then propagated to every z-plane beyond that by applying each plane wave component's phase change
+    (and atmospheric attenuation) in the 2D Fourier domain - so the cost per plane doesn't depend on the
+    number of transducers. Any planes before the source plane are computed directly.
+    """
+    y_vals, x_vals, z_vals = _gridAxes(3)
+    shape = (len(y_vals), len(x_vals), len(z_vals))
+    transducers = _TRANSDUCER_PARAMETERS
+
+    # The source plane has to have every transducer behind it, as propagation is only valid where there are no sources
+    # By default it's a wavelength beyond them, as the wave right next to a point source is too sharp to sample
+    max_transducer_z = max(position[2] for position, _, _ in transducers)
+    if ANGULAR_SPECTRUM_SOURCE_INDEX is None:
+        source_index = int(np.searchsorted(z_vals, max_transducer_z + _WAVELENGTH, side="left"))
+    else:
+        _checkAngularSpectrumSource()
+        source_index = ANGULAR_SPECTRUM_SOURCE_INDEX
+        if z_vals[source_index] <= max_transducer_z:
+            raise ValueError("The angular spectrum source plane must be beyond every transducer in z")
+
+    amplitude_matrix = np.empty(shape, dtype=_FLOAT_TYPE)
+
+    if source_index > 0:
+        _logger(f"Computing planes 0-{source_index-1} directly")
+        amplitude_matrix[:, :, :source_index] = _computeComplexField(
+            (y_vals, x_vals, z_vals[:source_index]), transducers, np.abs
+        )
+    if source_index >= shape[2]:
+        return amplitude_matrix
+
+    # The source plane is computed over a wider area than the grid, so waves heading
+    # into the grid at an angle from outside it are still included
+    padded_shape = (_ANGULAR_SPECTRUM_PADDING*shape[0], _ANGULAR_SPECTRUM_PADDING*shape[1])
+    y_offset = (padded_shape[0] - shape[0]) // 2
+    x_offset = (padded_shape[1] - shape[1]) // 2
+    y_spacing = y_vals[1] - y_vals[0]
+    x_spacing = x_vals[1] - x_vals[0]
+    padded_y_vals = y_vals[0] + (np.arange(padded_shape[0], dtype=_FLOAT_TYPE) - y_offset)*y_spacing
+    padded_x_vals = x_vals[0] + (np.arange(padded_shape[1], dtype=_FLOAT_TYPE) - x_offset)*x_spacing
+    grid_area = (slice(y_offset, y_offset+shape[0]), slice(x_offset, x_offset+shape[1]))
+
+    _logger(f"Computing source plane {source_index}")
+    source_plane = _computeComplexField(
+        (padded_y_vals, padded_x_vals, z_vals[source_index:source_index+1]), transducers, np.copy
+    )[:, :, 0]
+    amplitude_matrix[:, :, source_index] = np.abs(source_plane[grid_area])
+
+    # Tapering the widened area down to zero at its edges, as a sharp cut-off diffracts into the grid
+    source_plane *= _taperWindow(padded_shape[0], y_offset).reshape(-1, 1)
+    source_plane *= _taperWindow(padded_shape[1], x_offset).reshape(1, -1)
+
+    # Spatial frequencies of the zero-padded plane, in radians/mm
+    fft_shape = (_ANGULAR_SPECTRUM_GUARD*padded_shape[0], _ANGULAR_SPECTRUM_GUARD*padded_shape[1])
+    k_y = 2*np.pi*np.fft.fftfreq(fft_shape[0], d=y_spacing).reshape(-1, 1)
+    k_x = 2*np.pi*np.fft.fftfreq(fft_shape[1], d=x_spacing).reshape(1, -1)
+
+    # Complex wavenumber in radians/mm, with atmospheric attenuation (converted from Nepers/m) as its imaginary part
+    wavenumber = 2*np.pi/_WAVELENGTH + 1j*_ATTENUATION_CONSTANT/1000
+    # Evanescent components get a positive imaginary k_z, so they decay
+    k_z = np.sqrt(wavenumber**2 - k_x**2 - k_y**2)
+    plane_step = np.exp(1j*k_z*(z_vals[1]-z_vals[0]))
+
+    spectrum = np.fft.fft2(source_plane, s=fft_shape)
+    del source_plane
+
+    _logger(f"Propagating to planes {source_index+1}-{shape[2]-1}")
+    for z_index in range(source_index+1, shape[2]):
+        with _profileStage("angular_spectrum"):
+            spectrum *= plane_step
+            plane = np.fft.ifft2(spectrum)
+            amplitude_matrix[:, :, z_index] = np.abs(plane[grid_area])
+
+    return amplitude_matrix
+
+def compareAngularSpectrumAccuracy():
+    """
+    Runs the 3D simulation with both the direct summation and angular spectrum engines
+    Returns the max., mean and RMS absolute differences between the two, in dB, over the propagated planes
+    """
+    direct_db = _convertTodB(_simulateAmplitudes(3))
+    angular_spectrum_db = _convertTodB(_simulateAmplitudesAngularSpectrum())
+
+    max_transducer_z = max(position[2] for position, _, _ in _TRANSDUCER_PARAMETERS)
+    propagated = _gridAxes(3)[2] > max_transducer_z + _WAVELENGTH
+    errors = np.abs(direct_db - angular_spectrum_db)[:, :, propagated]
+
+    return {
+        "max_abs_error_db": float(errors.max()),
+        "mean_abs_error_db": float(errors.mean()),
+        "rms_error_db": float(np.sqrt(np.mean(np.square(errors))))
+    }
+
+def _multilinearWeights(fractions, corners):
+    """
+    Returns the weight of each of a block's corners when interpolating to points within it
+    fractions is an (points, n_dims) array of the points' positions across the block, from 0 to 1
+    corners is a (2**n_dims, n_dims) array of the corners' positions, each 0 or 1
+    """
+    return np.prod(
+        np.where(corners[np.newaxis], fractions[:, np.newaxis], 1 - fractions[:, np.newaxis]), axis=2
     )
 
-    # Computing all required bits to determine sound wave amplitude at each point in the grid
-    # Then applying these to the amplitude matrix
-    dist_matrix, angle_matrix = _computeTransducerDistancesAngles3D(
-        _TRANSDUCER_POS_VECTORS[transducer_no],
-        _TRANSDUCER_AXIS_VECTORS[transducer_no]
+def _sampleGridPoints(samples, points, axes_start, axes_spacing):
+    """
+    Returns the dB/dBA volume and the phase of the wave at grid points given as (..., n_dims) arrays of cell indices
+    Only points that haven't been computed yet are computed - samples holds "slots" (the position in the "dB"
+    and "phase" arrays of each cell's values, or -1 if it hasn't been computed), and is extended in place
+    """
+    n_dims = points.shape[-1]
+    flat_indices = np.ravel_multi_index(tuple(np.moveaxis(points, -1, 0)), samples["slots"].shape).ravel()
+    slots = samples["slots"].reshape(-1)
+
+    missing = np.sort(flat_indices[slots[flat_indices] < 0])
+    missing = missing[np.concatenate(([True], missing[1:] != missing[:-1]))] if len(missing) else missing
+
+    if len(missing):
+        # Coordinates in mm, along each axis of the simulation matrix
+        cells = np.unravel_index(missing, samples["slots"].shape)
+        coordinates = [(axes_start[i] + cells[i]*axes_spacing[i]).astype(_FLOAT_TYPE) for i in range(n_dims)]
+        complex_waves = _computePointWaves(coordinates[1], coordinates[0], coordinates[2] if n_dims == 3 else None)
+
+        slots[missing] = np.arange(len(samples["dB"]), len(samples["dB"]) + len(missing))
+        samples["dB"] = np.concatenate([samples["dB"], _convertTodB(np.abs(complex_waves))])
+        samples["phase"] = np.concatenate([samples["phase"], np.angle(complex_waves)])
+
+    point_slots = slots[flat_indices].reshape(points.shape[:-1])
+
+    return samples["dB"][point_slots], samples["phase"][point_slots]
+
+def runAdaptiveSimulation(n_dims):
+    """
+    Computes the volume in dB/dBA across the grid (2D or 3D) with adaptive refinement
+
+    The grid is split into blocks of ADAPTIVE_BLOCK_CELLS cells, which are sampled at their corners and midpoints.
+    Blocks where interpolating between the corners misses the midpoints by more than ADAPTIVE_TOLERANCE_DB
+    (or where the phase changes too quickly, or that hold a transducer) are split in half along every axis,
+    and the halves checked in turn - down to single cells
+    Each level's new sample points are computed in parallel, depending on CPU_CORES and EXECUTOR, and samples of
+    blocks overhanging the far edges of the grid are clipped to it, so no point outside the grid is ever computed
+
+    Returns a block-structured volume, as a dict of:
+        "shape" -> shape of the full simulation matrix
+        "leaves" -> {block size in cells: (first cell of each block, shape (blocks, n_dims),
+                     dB/dBA at each block's corners, shape (blocks, 2**n_dims))}
+        "evaluated_points" -> number of points the waves were computed at
+    """
+    block_size = ADAPTIVE_BLOCK_CELLS
+    if block_size < 2 or block_size & (block_size - 1):
+        raise ValueError("ADAPTIVE_BLOCK_CELLS must be a power of 2, and at least 2")
+
+    axes_values = _gridAxes(n_dims)
+    shape = np.array([len(i) for i in axes_values])
+    axes_start = [float(i[0]) for i in axes_values]
+    origin, cell_size, _ = getGridGeometry()
+    axes_spacing = [cell_size[i] for i in _MATRIX_AXIS_COMPONENTS[:n_dims]]
+
+    # Covering the grid with a whole number of the coarsest blocks, so every block is the same size
+    # Blocks at the far edges may overhang the grid - their samples outside it are clipped to its edges
+    n_blocks = np.maximum(-(-(shape - 1) // block_size), 1)
+
+    # Transducer positions in cells, along each axis of the simulation matrix
+    transducer_cells = np.array([
+        [(position[component] - origin[component]) / cell_size[component] for component in _MATRIX_AXIS_COMPONENTS[:n_dims]]
+        for position, _, _ in _TRANSDUCER_PARAMETERS
+    ]).reshape(-1, n_dims)
+
+    corners = np.indices((2,)*n_dims).reshape(n_dims, -1).T
+    # Points sampled in each block - its corners and midpoints, on a lattice of 3 points along each axis
+    lattice = np.indices((3,)*n_dims).reshape(n_dims, -1).T
+    is_corner = np.all(lattice != 1, axis=1)
+    interpolation_weights = _multilinearWeights(lattice / 2, corners)
+    # The lattice points at the corners of each of the block's halves
+    half_corners = np.ravel_multi_index(
+        tuple(np.moveaxis(corners[:, np.newaxis, :] + corners[np.newaxis, :, :], -1, 0)), (3,)*n_dims
     )
-    attenuation_factors = _computeAttenuationFactors(dist_matrix)
-    beam_angle_factors = userComputeBeamAngleResponse(angle_matrix)
 
-    # Applying those two calculations to the amplitudes
-    np.multiply(attenuation_factors, beam_angle_factors, out=attenuation_factors)
-    np.multiply(amplitude_matrix, attenuation_factors, out=amplitude_matrix)
+    samples = {
+        "slots": np.full(tuple(shape), -1, dtype=np.int32 if np.prod(shape) < 2**31 else np.int64),
+        "dB": np.empty(0, dtype=_FLOAT_TYPE),
+        "phase": np.empty(0)
+    }
+    starts = np.indices(n_blocks).reshape(n_dims, -1).T * block_size
+    leaves = {}
+
+    while len(starts):
+        half = block_size // 2
+        volume_db, phase = _sampleGridPoints(
+            samples, np.minimum(starts[:, np.newaxis, :] + lattice*half, shape - 1), axes_start, axes_spacing
+        )
 
-    # Computing phase offset in radians at each point in the grid
-    phase_offsets = np.divide(dist_matrix, _WAVELENGTH)
-    np.multiply(phase_offsets, 2*np.pi, out=phase_offsets)
+        # Refining wherever interpolating from the corners doesn't match the midpoints
+        errors = np.abs(volume_db - volume_db[:, is_corner] @ interpolation_weights.T)
+        refine = np.max(errors, axis=1) > ADAPTIVE_TOLERANCE_DB
+
+        if ADAPTIVE_PHASE_TOLERANCE is not None:
+            lattice_phase = phase.reshape((-1,) + (3,)*n_dims)
+            for axis in range(1, n_dims+1):
+                phase_steps = np.abs(np.angle(np.exp(1j*np.diff(lattice_phase, axis=axis))))
+                refine |= np.max(phase_steps.reshape(len(starts), -1), axis=1) / half > ADAPTIVE_PHASE_TOLERANCE
+
+        # The wave changes too quickly right next to a transducer to interpolate across,
+        # so the blocks holding a transducer and their neighbours are always refined
+        level_blocks = tuple(int(i) for i in n_blocks * (ADAPTIVE_BLOCK_CELLS // block_size))
+        near_blocks = np.floor(transducer_cells / block_size).astype(np.int64)[:, np.newaxis, :] + (lattice - 1)
+        near_blocks = near_blocks.reshape(-1, n_dims)
+        near_blocks = near_blocks[np.all((near_blocks >= 0) & (near_blocks < level_blocks), axis=1)]
+        refine |= np.isin(
+            np.ravel_multi_index(tuple((starts // block_size).T), level_blocks),
+            np.ravel_multi_index(tuple(near_blocks.T), level_blocks)
+        )
+        # Blocks overhanging the grid can't be interpolated from their clipped samples, so are always refined
+        refine |= np.any(starts + block_size > shape - 1, axis=1)
 
-    # Adding on transducer phase offset
-    np.add(phase_offsets, TRANSDUCERS[transducer_no][2], out=phase_offsets)
+        # Each block is stored as its halves, whose corners have all been sampled already
+        # Halves lying entirely outside the grid are dropped
+        half_starts = starts[:, np.newaxis, :] + corners*half
+        in_grid = np.all(half_starts < shape, axis=2)
+        stored = in_grid & (~refine[:, np.newaxis] | (half == 1))
 
-    # Using those to calculate wave phasors
-    complex_wave_amplitudes = np.exp(phase_offsets*_COMPLEX_TYPE(1j))
+        leaves[half] = (half_starts[stored], volume_db[:, half_corners][stored])
+        starts = half_starts[in_grid & ~stored]
+        block_size = half
 
-    # Applying wave amplitude (magnitude) to the wave phasor representation
-    np.multiply(amplitude_matrix, complex_wave_amplitudes, out=complex_wave_amplitudes)
-    _logger(f"Computed matrix {transducer_no}")
+    evaluated_points = len(samples["dB"])
+    _logger(f"Adaptive refinement computed {evaluated_points} points, for a grid of {int(np.prod(shape))} cells")
 
-    return complex_wave_amplitudes
+    return {"shape": tuple(int(i) for i in shape), "leaves": leaves, "evaluated_points": evaluated_points}
 
+def resampleAdaptiveVolume(volume):
+    """
+    Interpolates a block-structured volume from runAdaptiveSimulation() onto the full simulation matrix, e.g. for plotting
+    Each block is filled in by interpolating between its corners
+    The results are quantised if OUTPUT_QUANTISATION is set
+    """
+    shape = volume["shape"]
+    n_dims = len(shape)
+    corners = np.indices((2,)*n_dims).reshape(n_dims, -1).T
+    sim_matrix_db = np.empty(shape, dtype=_FLOAT_TYPE if OUTPUT_QUANTISATION is None else OUTPUT_QUANTISATION)
+
+    # Largest blocks first, so where blocks of different sizes share a face, the smaller blocks' samples are kept
+    for block_size in sorted(volume["leaves"], reverse=True):
+        starts, corner_db = volume["leaves"][block_size]
+        offsets = np.indices((block_size+1,)*n_dims).reshape(n_dims, -1).T
+        weights = _multilinearWeights(offsets / block_size, corners).astype(_FLOAT_TYPE)
+        chunk = max(1, _BLOCK_CELLS // len(offsets))
+
+        for start in range(0, len(starts), chunk):
+            cells = starts[start:start+chunk, np.newaxis, :] + offsets
+            values = corner_db[start:start+chunk] @ weights.T
+            if OUTPUT_QUANTISATION is not None:
+                values = quantiseDB(values)
+            in_grid = np.all(cells < shape, axis=2)
+            sim_matrix_db[tuple(cells[in_grid].T)] = values[in_grid]
 
+    return sim_matrix_db
 
 def runVectorisedSimulation2D():
     """
     Runs the simulation as a fully vectorised operation.
 
-    For each transducer, a matrix is computed with the volume levels at each
-    point in the simulation grid, and these matrices are then added together.
+    For each transducer, the wave it produces at each point in the simulation
+    grid is computed, and these waves are then added together.
+
+    If ADAPTIVE_REFINEMENT is True, the grid is computed with adaptive refinement instead
     """
-    transducer_indexes = list(range(len(TRANSDUCERS)))
+    if ADAPTIVE_REFINEMENT:
+        return resampleAdaptiveVolume(runAdaptiveSimulation(2))
 
-    if (CPU_CORES == 1):
-        sim_matrix = np.full(
-            (PLOTSIZE+1, PLOTSIZE+1),
-            0+0j,
-            dtype=_COMPLEX_TYPE
-        )
+    if OUTPUT_QUANTISATION is not None:
+        sim_matrix_db = _simulateAmplitudes(2, output="quantised")
+    else:
+        sim_matrix = _simulateAmplitudes(2)
+
+        with _profileStage("dB_conversion"):
+            sim_matrix_db = _convertTodB(sim_matrix)
+    _writeProfileReport()
+
+    return sim_matrix_db
+
+def _configMetadata():
+    """
+    Returns a JSON-serialisable dict of the simulation settings that affect the results
+    """
+    origin, cell_size, n_cells = getGridGeometry()
+
+    return {
+        "PLOTSIZE": PLOTSIZE,
+        "CELL_SIDE_LENGTH_MM": CELL_SIDE_LENGTH_MM,
+        # The grid actually simulated, along x, y and z
+        "GRID_ORIGIN_MM": origin,
+        "GRID_CELL_SIZE_MM": cell_size,
+        "GRID_CELLS": n_cells,
+        "COMPRESS_FLOAT": COMPRESS_FLOAT,
+        "FREQUENCY": FREQUENCY,
+        "TEMPERATURE_DEG_C": TEMPERATURE_DEG_C,
+        "PRESSURE_KPA": PRESSURE_KPA,
+        "RELATIVE_HUMIDITY": RELATIVE_HUMIDITY,
+        "TRANSDUCER_TRANSMITTING_PRESSURE_LEVEL": TRANSDUCER_TRANSMITTING_PRESSURE_LEVEL,
+        "R0": R0,
+        "DIRECTIVITY_MODE": DIRECTIVITY_MODE,
+        "DIRECTIVITY_TABLE_SIZE": DIRECTIVITY_TABLE_SIZE,
+        "DIRECTIVITY_DATA_PATH": DIRECTIVITY_DATA_PATH,
+        "DIRECTIVITY_DATA_DB": DIRECTIVITY_DATA_DB,
+        "dBA": dBA,
+        "OUTPUT_QUANTISATION": OUTPUT_QUANTISATION,
+        "TRANSDUCERS": [[list(position), transducer_axis.tolist(), transducer_phase]
+            for position, transducer_axis, transducer_phase in _TRANSDUCER_PARAMETERS]
+    }
+
+def _pyramidPath(store_path, level):
+    """
+    Path of a level of a store's multiscale pyramid - level 0 is the full resolution results
+    """
+    if level == 0:
+        return os.path.join(store_path, "volume.npy")
+
+    return os.path.join(store_path, f"pyramid_{level}.npy")
+
+def _downsampleMax(matrix, factor):
+    """
+    Shrinks a matrix by the given factor along every axis, keeping the max. value of each block of cells
+    The blocks at the far edges are smaller if the matrix's shape isn't a multiple of the factor
+    """
+    for axis in range(matrix.ndim):
+        matrix = np.maximum.reduceat(matrix, np.arange(0, matrix.shape[axis], factor), axis=axis)
+
+    return matrix
+
+def _coverageRegionBox(axes_values):
+    """
+    Converts COVERAGE_REGION_MM into a (start, stop) range of cells along each axis of the simulation matrix
+    Returns None if no region is set
+    """
+    if COVERAGE_REGION_MM is None:
+        return None
+
+    low, high = COVERAGE_REGION_MM
+    box = []
+    for matrix_axis, values in enumerate(axes_values):
+        component = _MATRIX_AXIS_COMPONENTS[matrix_axis]
+        box.append((
+            int(np.searchsorted(values, low[component], side="left")),
+            int(np.searchsorted(values, high[component], side="right"))
+        ))
+
+    return box
+
+def _coveragePartial(sim_matrix_db, row_start=0, region_box=None):
+    """
+    Computes the coverage statistics of a slab of the dB results, starting at row_start of the grid
+    The results are partial sums (and the min./max. with their cells), so slabs' results can be merged in any order
+    """
+    min_cell = np.unravel_index(np.argmin(sim_matrix_db), sim_matrix_db.shape)
+    max_cell = np.unravel_index(np.argmax(sim_matrix_db), sim_matrix_db.shape)
+
+    # Levels are never negative, so each level's histogram bin is just its level divided by the bin width
+    histogram_bins = sim_matrix_db * _FLOAT_TYPE(1/COVERAGE_HISTOGRAM_BIN_DB)
+
+    partial = {
+        "cells": sim_matrix_db.size,
+        "sum_db": float(np.sum(sim_matrix_db, dtype=np.float64)),
+        "min_db": float(sim_matrix_db[min_cell]),
+        "min_cell": (min_cell[0] + row_start,) + tuple(min_cell[1:]),
+        "max_db": float(sim_matrix_db[max_cell]),
+        "max_cell": (max_cell[0] + row_start,) + tuple(max_cell[1:]),
+        "cells_above": np.array([np.count_nonzero(sim_matrix_db >= i) for i in COVERAGE_THRESHOLDS_DB], dtype=np.int64),
+        "histogram": np.bincount(histogram_bins.astype(np.int64).ravel()),
+        "region_cells": 0,
+        "region_sum_db": 0.0
+    }
+
+    if region_box is not None:
+        # The region's rows, relative to the slab
+        (row_low, row_high), *other_axes = region_box
+        region = (slice(max(row_low - row_start, 0), max(row_high - row_start, 0)),) + tuple(slice(*i) for i in other_axes)
+        region_db = sim_matrix_db[region]
+        partial["region_cells"] = region_db.size
+        partial["region_sum_db"] = float(np.sum(region_db, dtype=np.float64))
+
+    return partial
+
+def _mergeCoverage(partial, other):
+    """
+    Merges the coverage statistics of two parts of the grid
+    """
+    histogram = np.zeros(max(len(partial["histogram"]), len(other["histogram"])), dtype=np.int64)
+    histogram[:len(partial["histogram"])] += partial["histogram"]
+    histogram[:len(other["histogram"])] += other["histogram"]
+
+    return {
+        "cells": partial["cells"] + other["cells"],
+        "sum_db": partial["sum_db"] + other["sum_db"],
+        "min_db": min(partial["min_db"], other["min_db"]),
+        "min_cell": partial["min_cell"] if partial["min_db"] <= other["min_db"] else other["min_cell"],
+        "max_db": max(partial["max_db"], other["max_db"]),
+        "max_cell": partial["max_cell"] if partial["max_db"] >= other["max_db"] else other["max_cell"],
+        "cells_above": partial["cells_above"] + other["cells_above"],
+        "histogram": histogram,
+        "region_cells": partial["region_cells"] + other["region_cells"],
+        "region_sum_db": partial["region_sum_db"] + other["region_sum_db"]
+    }
+
+def _cellPosition(axes_values, cell):
+    """
+    Converts a cell's index in the simulation matrix into its [x, y, z] position in mm
+    """
+    position = [0.0, 0.0, 0.0]
+    for matrix_axis, index in enumerate(cell):
+        position[_MATRIX_AXIS_COMPONENTS[matrix_axis]] = float(axes_values[matrix_axis][index])
+
+    return position
+
+def _finaliseCoverage(partial, axes_values):
+    """
+    Turns merged coverage statistics into a JSON-serialisable dict of the final statistics
+    """
+    return {
+        "cells": int(partial["cells"]),
+        "mean_db": partial["sum_db"] / partial["cells"],
+        "min_db": partial["min_db"],
+        "min_position_mm": _cellPosition(axes_values, partial["min_cell"]),
+        "max_db": partial["max_db"],
+        "max_position_mm": _cellPosition(axes_values, partial["max_cell"]),
+        "thresholds_db": list(COVERAGE_THRESHOLDS_DB),
+        "fraction_above": (partial["cells_above"] / partial["cells"]).tolist(),
+        "histogram_bin_db": COVERAGE_HISTOGRAM_BIN_DB,
+        "histogram": partial["histogram"].tolist(),
+        "region_mean_db": partial["region_sum_db"] / partial["region_cells"] if partial["region_cells"] else None
+    }
+
+def computeCoverageStatistics(sim_matrix_db):
+    """
+    Computes the coverage statistics of existing dB results (2D or 3D, quantised or not) - see runCoverageStatistics()
+    Works through the results STREAM_SLAB_ROWS rows at a time, so memory-mapped results aren't all read into memory
+    """
+    axes_values = _gridAxes(sim_matrix_db.ndim)
+    region_box = _coverageRegionBox(axes_values)
+    slabs = (
+        (_coveragePartial(dequantiseDB(sim_matrix_db[start:start+STREAM_SLAB_ROWS]), start, region_box), {})
+        for start in range(0, len(sim_matrix_db), STREAM_SLAB_ROWS)
+    )
+
+    return _finaliseCoverage(_mergeSlabCoverage(slabs), axes_values)
+
+def _coverageSlab(task):
+    """
+    Worker function - computes a slab of the grid, and returns its coverage statistics (and the worker's profiling records)
+    task is a ((start, stop) rows, grid axes values, transducers, region box) tuple
+    """
+    (start, stop), axes_values, transducers, region_box = task
+    slab_axes = (axes_values[0][start:stop],) + tuple(axes_values[1:])
+
+    slab = np.zeros(tuple(len(i) for i in slab_axes), dtype=_COMPLEX_TYPE)
+    _accumulateTransducers(slab, slab_axes, transducers)
+
+    with _profileStage("reduction"):
+        slab = np.abs(slab)
+    with _profileStage("dB_conversion"):
+        slab_db = _convertTodB(slab)
+    with _profileStage("statistics"):
+        partial = _coveragePartial(slab_db, start, region_box)
+
+    return partial, _takeProfile()
+
+def _mergeSlabCoverage(results):
+    """
+    Merges the coverage statistics of slabs as they're finished, along with their workers' profiling records
+    results is an iterable of (coverage statistics, profiling records) tuples
+    """
+    coverage = None
+    for slab_stats, records in results:
+        coverage = slab_stats if coverage is None else _mergeCoverage(coverage, slab_stats)
+        _mergeProfile(records)
+
+    return coverage
+
+def runCoverageStatistics(n_dims):
+    """
+    Computes coverage statistics across the grid (2D or 3D), without ever holding the whole dB results in memory
+    The grid is worked through STREAM_SLAB_ROWS rows at a time, and each slab's statistics are merged as it's finished
+
+    Returns a dict of: the number of cells, mean level, min./max. level and their positions (in mm), the fraction of cells
+    at or above each of COVERAGE_THRESHOLDS_DB, a histogram of the levels in bins of COVERAGE_HISTOGRAM_BIN_DB
+    (starting from 0dB), and the mean level in COVERAGE_REGION_MM (None if it isn't set)
+
+    The slabs are computed with the direct engine - with ADAPTIVE_REFINEMENT or the angular spectrum ENGINE,
+    the whole dB results are computed as usual instead, and their statistics taken slab by slab
+    """
+    if ADAPTIVE_REFINEMENT or (n_dims == 3 and ENGINE != "direct"):
+        run_simulation = runVectorisedSimulation3D if n_dims == 3 else runVectorisedSimulation2D
+        return computeCoverageStatistics(run_simulation())
+
+    axes_values = _gridAxes(n_dims)
+    n_rows = len(axes_values[0])
+    region_box = _coverageRegionBox(axes_values)
+    tasks = [
+        ((start, min(start+STREAM_SLAB_ROWS, n_rows)), axes_values, _TRANSDUCER_PARAMETERS, region_box)
+        for start in range(0, n_rows, STREAM_SLAB_ROWS)
+    ]
+
+    _logger(f"Computing coverage statistics over {len(tasks)} slabs")
+    executor = _chooseExecutor(int(np.prod([len(i) for i in axes_values])), len(_TRANSDUCER_PARAMETERS))
+    coverage = _mergeSlabCoverage(_mapTasks(_coverageSlab, tasks, executor))
+    _logger("Computed coverage statistics")
+    _writeProfileReport()
+
+    return _finaliseCoverage(coverage, axes_values)
+
+def _streamedType():
+    """
+    Type of the dB results written to disk while streaming - quantised if OUTPUT_QUANTISATION is set
+    """
+    return _FLOAT_TYPE if OUTPUT_QUANTISATION is None else OUTPUT_QUANTISATION
+
+def _streamSlab(task):
+    """
+    Worker function - computes a slab of the 3D grid, converts it to dB and writes it straight into the on-disk store
+    Each downsampled level of the store's pyramid is written from the slab too
+    task is a (store path, (start, stop) rows, grid axes values, transducers) tuple
+
+    Returns the slab's coverage statistics, and the worker's profiling records
+    """
+    store_path, (start, stop), axes_values, transducers, region_box = task
+    slab_axes = (axes_values[0][start:stop],) + tuple(axes_values[1:])
+
+    _logger(f"Started streaming slab {start}-{stop}")
+    slab = np.zeros(tuple(len(i) for i in slab_axes), dtype=_COMPLEX_TYPE)
+    _accumulateTransducers(slab, slab_axes, transducers)
+
+    with _profileStage("reduction"):
+        slab = np.abs(slab)
+    with _profileStage("dB_conversion"):
+        slab_db = _convertTodB(slab)
+    with _profileStage("statistics"):
+        partial = _coveragePartial(slab_db, start, region_box)
+    if OUTPUT_QUANTISATION is not None:
+        with _profileStage("dB_conversion"):
+            slab_db = quantiseDB(slab_db)
+
+    with _profileStage("transfer"):
+        _writeStoreSlab(store_path, start, slab_db)
+    _logger(f"Streamed slab {start}-{stop}")
+
+    return partial, _takeProfile()
+
+def _writeStoreSlab(store_path, start, slab_db):
+    """
+    Writes a slab of dB results starting at row start into an on-disk store, along with each level of its pyramid
+    """
+    level_db = slab_db
+    for level in range(STREAM_PYRAMID_LEVELS+1):
+        if level > 0:
+            level_db = _downsampleMax(level_db, 2)
+
+        # Slabs start on a multiple of 2**STREAM_PYRAMID_LEVELS rows, so they line up with every level
+        volume = np.load(_pyramidPath(store_path, level), mmap_mode="r+")
+        volume[start // 2**level:start // 2**level + len(level_db)] = level_db
+        volume.flush()
+        del volume
+
+def runStreamingSimulation3D(store_path):
+    """
+    Runs the 3D simulation slab by slab, writing each slab's dB results straight into an on-disk store
+    Memory usage is bounded by the size of a slab (STREAM_SLAB_ROWS rows) per CPU core, not the whole cube
 
-        for i in transducer_indexes:
-            sim_matrix += _generateTransducerMatrix2D(i)
+    The store is a directory holding the results as a .npy file, STREAM_PYRAMID_LEVELS downsampled copies of them,
+    and a metadata.json recording the simulation settings and the results' coverage statistics (see runCoverageStatistics())
+    Returns the results, memory-mapped read-only from the store
+
+    The slabs are computed with the direct engine - with ADAPTIVE_REFINEMENT or the angular spectrum ENGINE,
+    the whole dB results are computed as usual instead, and then written into the store slab by slab
+    """
+    os.makedirs(store_path, exist_ok=True)
+
+    axes_values = _gridAxes(3)
+    shape = tuple(len(i) for i in axes_values)
+
+    # Creating the (empty) volume files that the slabs are written into
+    for level in range(STREAM_PYRAMID_LEVELS+1):
+        level_shape = tuple(-(-i // 2**level) for i in shape)
+        volume = np.lib.format.open_memmap(
+            _pyramidPath(store_path, level), mode="w+", dtype=_streamedType(), shape=level_shape
+        )
+        del volume
+
+    # Rounding the slabs up to a whole number of the coarsest pyramid level's cells
+    slab_rows = -(-STREAM_SLAB_ROWS // 2**STREAM_PYRAMID_LEVELS) * 2**STREAM_PYRAMID_LEVELS
+
+    if ADAPTIVE_REFINEMENT or ENGINE != "direct":
+        sim_matrix_db = _simulateVolumeDB()
+        region_box = _coverageRegionBox(axes_values)
+        coverage = None
+
+        for start in range(0, shape[0], slab_rows):
+            slab_db = sim_matrix_db[start:start+slab_rows]
+            partial = _coveragePartial(dequantiseDB(slab_db), start, region_box)
+            coverage = partial if coverage is None else _mergeCoverage(coverage, partial)
+            _writeStoreSlab(store_path, start, slab_db)
+        del sim_matrix_db
     else:
-        with Pool(processes=CPU_CORES) as pool:
-            results = pool.map(_generateTransducerMatrix2D, transducer_indexes)
-        # Summing all the results matrices and taking absolute wave amplitude at each point
-        sim_matrix = np.sum(results, axis=0)
+        tasks = [
+            (store_path, (start, min(start+slab_rows, shape[0])), axes_values, _TRANSDUCER_PARAMETERS, _coverageRegionBox(axes_values))
+            for start in range(0, shape[0], slab_rows)
+        ]
+
+        executor = _chooseExecutor(int(np.prod(shape)), len(_TRANSDUCER_PARAMETERS))
+        coverage = _mergeSlabCoverage(_mapTasks(_streamSlab, tasks, executor))
+        _writeProfileReport()
+
+    metadata = _configMetadata()
+    metadata["shape"] = list(shape)
+    metadata["dtype"] = np.dtype(_streamedType()).name
+    # dB = stored value * db_scale + db_offset
+    metadata["db_scale"] = getQuantisationScale(_streamedType()) or 1.0
+    metadata["db_offset"] = 0.0
+    metadata["pyramid_levels"] = STREAM_PYRAMID_LEVELS
+    metadata["coverage"] = _finaliseCoverage(coverage, axes_values)
+    metadata["min_db"] = metadata["coverage"]["min_db"]
+    metadata["max_db"] = metadata["coverage"]["max_db"]
+
+    with open(os.path.join(store_path, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return openSimulationStore(store_path)[0]
+
+def openSimulationStore(store_path):
+    """
+    Opens a store written by runStreamingSimulation3D() without loading it into memory
+    Returns the memory-mapped dB results, and the metadata dict
+    """
+    with open(os.path.join(store_path, "metadata.json")) as f:
+        metadata = json.load(f)
 
-    # Summing all the results matrices and taking absolute wave amplitude at each point
-    sim_matrix = np.abs(sim_matrix)
+    volume = np.load(_pyramidPath(store_path, 0), mmap_mode="r")
 
-    sim_matrix_db = _convertTodB(sim_matrix)
+    return volume, metadata
 
-    return sim_matrix_db
+def openSimulationPyramid(store_path):
+    """
+    Opens every level of a store's multiscale pyramid without loading them into memory
+    Returns a list of the memory-mapped dB results, from full resolution down to the coarsest level
+    """
+    volume, metadata = openSimulationStore(store_path)
+
+    # Stores written before pyramids were added only hold the full resolution results
+    levels = [volume]
+    for level in range(1, metadata.get("pyramid_levels", 0)+1):
+        levels.append(np.load(_pyramidPath(store_path, level), mmap_mode="r"))
+
+    return levels
 
 def runVectorisedSimulation3D():
     """
     Runs the 3D simulation as a fully vectorised operation.
 
-    For each transducer, a matrix is computed with the volume levels at each
-    point in the simulation grid, and these matrices are then added together.
+    For each transducer, the wave it produces at each point in the simulation
+    grid is computed, and these waves are then added together.
+
+    If STREAM_OUTPUT_PATH is set, the simulation is streamed to disk slab by slab instead
+    If ENGINE is "angular_spectrum", the waves are propagated plane to plane with FFTs instead
+    If ADAPTIVE_REFINEMENT is True, the grid is computed with adaptive refinement instead
     """
-    transducer_indexes = list(range(len(TRANSDUCERS)))
+    if STREAM_OUTPUT_PATH is not None:
+        return runStreamingSimulation3D(STREAM_OUTPUT_PATH)
 
-    if (CPU_CORES == 1):
-        sim_matrix = np.full(
-            (PLOTSIZE+1, PLOTSIZE+1, PLOTSIZE+1),
-            0+0j,
-            dtype=_COMPLEX_TYPE
-        )
+    return _simulateVolumeDB()
 
-        for i in transducer_indexes:
-            sim_matrix += _generateTransducerMatrix3D(i)
+def _simulateVolumeDB():
+    """
+    Runs the whole 3D simulation in memory with the selected ENGINE (or ADAPTIVE_REFINEMENT), returning its dB results
+    The results are quantised if OUTPUT_QUANTISATION is set
+    """
+    if ADAPTIVE_REFINEMENT:
+        return resampleAdaptiveVolume(runAdaptiveSimulation(3))
+
+    if ENGINE == "angular_spectrum":
+        sim_matrix = _simulateAmplitudesAngularSpectrum()
+    elif OUTPUT_QUANTISATION is not None:
+        sim_matrix = _simulateAmplitudes(3, output="quantised")
     else:
-        with Pool(processes=CPU_CORES) as pool:
-            results = pool.map(_generateTransducerMatrix3D, transducer_indexes)
-        # Summing all the results matrices and taking absolute wave amplitude at each point
-        _logger("Summing matrices")
-        sim_matrix = np.sum(results, axis=0)
+        sim_matrix = _simulateAmplitudes(3)
 
-    sim_matrix = np.abs(sim_matrix)
+    with _profileStage("dB_conversion"):
+        if OUTPUT_QUANTISATION is None:
+            sim_matrix_db = _convertTodB(sim_matrix)
+        elif np.issubdtype(sim_matrix.dtype, np.integer):
+            sim_matrix_db = sim_matrix
+        else:
+            sim_matrix_db = _convertTodB(sim_matrix, quantise=True)
+    _writeProfileReport()
 
-    sim_matrix_db = _convertTodB(sim_matrix)
     return sim_matrix_db
+
+def _sumPointWaves(x_vals, y_vals, z_vals):
+    """
+    Sums the complex waves from every transducer at a list of points, in chunks of BLOCK_CELLS
+    x_vals/y_vals/z_vals are 1D arrays of the points' coordinates, in mm - z_vals is None for 2D simulations
+    """
+    complex_waves = np.zeros(len(x_vals), dtype=_COMPLEX_TYPE)
+    batch_size = _batchSize(len(x_vals), len(_TRANSDUCER_PARAMETERS))
+    batches = [
+        _transducerBatch(_TRANSDUCER_PARAMETERS[i:i+batch_size], 1)
+        for i in range(0, len(_TRANSDUCER_PARAMETERS), batch_size)
+    ]
+
+    for start in range(0, len(x_vals), _BLOCK_CELLS):
+        chunk = slice(start, start+_BLOCK_CELLS)
+        for batch in batches:
+            _accumulateTransducerBlock(
+                batch,
+                x_vals[chunk],
+                y_vals[chunk],
+                None if z_vals is None else z_vals[chunk],
+                complex_waves[chunk]
+            )
+
+    return complex_waves
+
+def _pointWavesSlab(task):
+    """
+    Worker function - sums the complex waves from every transducer at a slab of a list of points
+    task is a ((start, stop) points, x coordinates, y coordinates, z coordinates) tuple, holding only the slab's points
+
+    Returns the slab's start, its complex waves, and the worker's profiling records
+    """
+    (start, stop), x_vals, y_vals, z_vals = task
+
+    return start, _sumPointWaves(x_vals, y_vals, z_vals), _takeProfile()
+
+def _computePointWaves(x_vals, y_vals, z_vals):
+    """
+    Sums the complex waves from every transducer at a list of points
+    x_vals/y_vals/z_vals are 1D arrays of the points' coordinates, in mm - z_vals is None for 2D simulations
+    Runs in serial or in parallel depending on CPU_CORES and EXECUTOR, with the points split into slabs between the workers
+    """
+    executor = _chooseExecutor(len(x_vals), len(_TRANSDUCER_PARAMETERS))
+    if executor == "serial":
+        return _sumPointWaves(x_vals, y_vals, z_vals)
+
+    tasks = [
+        ((start, stop), x_vals[start:stop], y_vals[start:stop], None if z_vals is None else z_vals[start:stop])
+        for start, stop in _computeSlabs(len(x_vals))
+    ]
+    complex_waves = np.empty(len(x_vals), dtype=_COMPLEX_TYPE)
+
+    for start, slab_waves, records in _mapTasks(_pointWavesSlab, tasks, executor):
+        complex_waves[start:start+len(slab_waves)] = slab_waves
+        _mergeProfile(records)
+
+    return complex_waves
+
+def runPointSimulation(points, output="dB"):
+    """
+    Computes the sound at an arbitrary set of points, such as microphone positions or a measurement path
+    points is an (M, 3) array of x-y-z positions, in mm
+
+    Uses the same wave model as the grid simulations, working through the points in chunks of BLOCK_CELLS
+    (in parallel, depending on CPU_CORES and EXECUTOR)
+    output selects what's returned: "complex" -> complex wave at each point, "dB" -> volume in dB/dBA at each point
+    """
+    points = np.asarray(points, dtype=_FLOAT_TYPE).reshape(-1, 3)
+    complex_waves = _computePointWaves(points[:, 0], points[:, 1], points[:, 2])
+
+    if output == "complex":
+        return complex_waves
+    if output == "dB":
+        return _convertTodB(np.abs(complex_waves))
+
+    raise ValueError(f"Unknown point simulation output: {output}")
+
+def computeSlice(matrix_axis, index, output="dB"):
+    """
+    Computes a single plane of the 3D grid - the cells at the given index along one axis of the simulation matrix
+    Returns the plane's volume in dB/dBA, the same as indexing the full 3D results at that index
+    (or its complex wave, if output is "complex")
+
+    The plane is computed in this process, as it's small enough not to be worth starting worker processes for
+    """
+    axes_values = list(_gridAxes(3))
+    axes_values[matrix_axis] = axes_values[matrix_axis][index:index+1]
+
+    sim_matrix = np.zeros(tuple(len(i) for i in axes_values), dtype=_COMPLEX_TYPE)
+    _accumulateTransducers(sim_matrix, axes_values, _TRANSDUCER_PARAMETERS)
+    sim_matrix = np.take(sim_matrix, 0, axis=matrix_axis)
+
+    if output == "complex":
+        return sim_matrix
+    if output == "dB":
+        return _convertTodB(np.abs(sim_matrix))
+
+    raise ValueError(f"Unknown slice output: {output}")
+
+def runComplexSimulation(n_dims):
+    """
+    Sums the complex waves from every transducer across the grid (2D or 3D), returning the complex wave
+    rather than its volume in dB - e.g. for animating the instantaneous sound pressure with generatePressureFrames()
+    Each cell's complex wave P gives the sound pressure (in Pa) over time as Re(P*e^(-iwt))
+    """
+    sim_matrix = _simulateAmplitudes(n_dims, output="complex")
+    _writeProfileReport()
+
+    return sim_matrix
+
+def _pressureFrame(complex_field, frame_no, frames_per_period, out=None):
+    """
+    Rotates the complex wave to a point in time, and takes the real part - the instantaneous sound pressure (in Pa)
+    Time is in steps of 1/frames_per_period of the wave's period
+    """
+    # Re(P*e^(-iwt)) = Re(P)cos(wt) + Im(P)sin(wt)
+    wt = 2*np.pi*frame_no/frames_per_period
+    out = np.multiply(complex_field.real, _FLOAT_TYPE(np.cos(wt)), out=out)
+    out += complex_field.imag * _FLOAT_TYPE(np.sin(wt))
+
+    return out
+
+def generatePressureFrames(complex_field, frames_per_period=None):
+    """
+    Yields the instantaneous sound pressure (in Pa) across a complex wave (e.g. from runComplexSimulation(),
+    computeSlice() or a SimulationSession) at frames_per_period evenly spaced times through one period of the wave
+    Defaults to ANIMATION_FRAMES_PER_PERIOD frames - the frames loop seamlessly
+
+    The same frame matrix is reused for every frame, so copy it if it needs to be kept
+    """
+    if frames_per_period is None:
+        frames_per_period = ANIMATION_FRAMES_PER_PERIOD
+    frame = np.empty(complex_field.shape, dtype=_FLOAT_TYPE)
+
+    for frame_no in range(frames_per_period):
+        yield _pressureFrame(complex_field, frame_no, frames_per_period, out=frame)
+
+def _writePressureFrame(frames, complex_field, frame_no, scale):
+    """
+    Computes a frame of the animation, and writes it into the on-disk frames as 16-bit integers
+    """
+    frame = _pressureFrame(complex_field, frame_no, len(frames))
+    np.multiply(frame, _FLOAT_TYPE(1/scale), out=frame)
+    np.rint(frame, out=frame)
+    frames[frame_no] = frame
+
+def writePressureAnimation(complex_field, store_path, frames_per_period=None):
+    """
+    Writes an animation of the instantaneous sound pressure across a complex wave (2D or 3D) to disk
+    Frames are computed and written in parallel, by the CPU_CORES worker threads sharing the complex wave
+
+    The store is a directory holding the frames as a (frames, ...) .npy file of 16-bit integers, and a metadata.json
+    recording the simulation settings and the scale (in Pa per unit) to convert the frames back into pressures
+    Returns the frames, memory-mapped read-only from the store
+    """
+    if frames_per_period is None:
+        frames_per_period = ANIMATION_FRAMES_PER_PERIOD
+    os.makedirs(store_path, exist_ok=True)
+
+    # The pressure never goes beyond the wave's amplitude, so the loudest cell sets the scale
+    peak_pressure = float(np.abs(complex_field).max())
+    scale = peak_pressure/np.iinfo(np.int16).max if peak_pressure > 0 else 1.0
+
+    frames = np.lib.format.open_memmap(
+        os.path.join(store_path, "frames.npy"), mode="w+", dtype=np.int16,
+        shape=(frames_per_period,) + complex_field.shape
+    )
+
+    _logger(f"Writing {frames_per_period} animation frames")
+    # NumPy releases the GIL, so threads compute frames in parallel without copying the complex wave to other processes
+    list(_threadPool().map(partial(_writePressureFrame, frames, complex_field, scale=scale), range(frames_per_period)))
+    frames.flush()
+    del frames
+    _logger("Written animation frames")
+
+    metadata = _configMetadata()
+    metadata["shape"] = list(complex_field.shape)
+    metadata["frames_per_period"] = frames_per_period
+    metadata["scale"] = scale
+
+    with open(os.path.join(store_path, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    return openPressureAnimation(store_path)[0]
+
+def openPressureAnimation(store_path):
+    """
+    Opens an animation written by writePressureAnimation() without loading it into memory
+    Returns the memory-mapped frames (multiply by metadata["scale"] for pressures in Pa), and the metadata dict
+    """
+    with open(os.path.join(store_path, "metadata.json")) as f:
+        metadata = json.load(f)
+
+    frames = np.load(os.path.join(store_path, "frames.npy"), mmap_mode="r")
+
+    return frames, metadata
+
+def computeTransducerField(n_dims, transducer_no):
+    """
+    Computes the zero-phase complex wave of a single transducer across the grid (2D or 3D)
+    """
+    position, transducer_axis, _ = _TRANSDUCER_PARAMETERS[transducer_no]
+
+    return _computeComplexField(_gridAxes(n_dims), [(position, transducer_axis, 0.0)], np.copy)
+
+def computeTransducerBasisFields(n_dims):
+    """
+    Computes the zero-phase complex wave of each transducer across the grid (2D or 3D)
+
+    Returns a matrix of shape (number of transducers, number of grid cells) - each row
+    can be reshaped to the simulation matrix shape
+    These are used as a basis for evaluating many phase/gain combinations with runPhaseSweep()
+    """
+    axes_values = _gridAxes(n_dims)
+    shape = tuple(len(i) for i in axes_values)
+    basis_fields = np.empty((len(_TRANSDUCER_PARAMETERS), int(np.prod(shape))), dtype=_COMPLEX_TYPE)
+
+    for i, (position, transducer_axis, _) in enumerate(_TRANSDUCER_PARAMETERS):
+        _computeComplexField(
+            axes_values,
+            [(position, transducer_axis, 0.0)],
+            partial(np.copyto, basis_fields[i].reshape(shape))
+        )
+
+    return basis_fields
+
+def runPhaseSweep(basis_fields, phases, gains=None, output="dB"):
+    """
+    Evaluates a batch of transducer phase offset (and optionally gain) combinations against the basis fields
+    from computeTransducerBasisFields()
+
+    phases is a matrix of shape (number of configurations, number of transducers), in radians
+    gains is an optional matrix of the same shape (or one gain per transducer) scaling each transducer's amplitude
+
+    Each configuration is a weighted sum of the basis fields, so the batch is computed as a matrix product,
+    a chunk of grid cells at a time
+    output selects what's returned:
+        "complex" -> complex wave matrix for each configuration, shape (configurations, cells)
+        "dB" -> volume in dB/dBA for each configuration, shape (configurations, cells)
+        "stats" -> dict of max/min/mean dB/dBA for each configuration, without storing any fields
+    """
+    phases = np.atleast_2d(phases)
+    weights = np.exp(1j*phases).astype(_COMPLEX_TYPE)
+    if gains is not None:
+        np.multiply(weights, np.broadcast_to(gains, weights.shape), out=weights)
+
+    n_configs = weights.shape[0]
+    n_cells = basis_fields.shape[1]
+    chunk = max(1, _SWEEP_CHUNK_BYTES // (n_configs * np.dtype(_COMPLEX_TYPE).itemsize))
+
+    if output == "complex":
+        results = np.empty((n_configs, n_cells), dtype=_COMPLEX_TYPE)
+    elif output == "dB":
+        results = np.empty((n_configs, n_cells), dtype=_FLOAT_TYPE)
+    elif output == "stats":
+        results = {
+            "max": np.full(n_configs, -np.inf),
+            "min": np.full(n_configs, np.inf),
+            "mean": np.zeros(n_configs)
+        }
+    else:
+        raise ValueError(f"Unknown phase sweep output: {output}")
+
+    for start in range(0, n_cells, chunk):
+        stop = min(start+chunk, n_cells)
+        chunk_fields = weights @ basis_fields[:, start:stop]
+
+        if output == "complex":
+            results[:, start:stop] = chunk_fields
+            continue
+
+        chunk_db = _convertTodB(np.abs(chunk_fields))
+        if output == "dB":
+            results[:, start:stop] = chunk_db
+        else:
+            np.maximum(results["max"], chunk_db.max(axis=1), out=results["max"])
+            np.minimum(results["min"], chunk_db.min(axis=1), out=results["min"])
+            results["mean"] += chunk_db.sum(axis=1, dtype=np.float64) / n_cells
+
+    return results
+
+def _accumulateSweepBlocks(energy, fields, axes_values, transducers, frequencies, tone_gains):
+    """
+    Simulates a grid at each of a list of frequencies one cache-sized block at a time, adding every frequency's
+    (weighted) energy to the energy matrix - and storing its amplitudes in fields[frequency no.] if fields isn't None
+
+    The distances, angles and beam angle response of each block are computed once, and reused for every frequency
+    - only the wavelength and atmospheric attenuation change with frequency
+    """
+    batch_size = _batchSize(energy.size, len(transducers))
+    batches = [
+        (_transducerBatch(transducers[i:i+batch_size], energy.ndim), [j[0] for j in transducers[i:i+batch_size]])
+        for i in range(0, len(transducers), batch_size)
+    ]
+    # Atmospheric attenuation in Nepers/mm, and wavenumber in radians/mm, at each frequency
+    attenuation_constants = [_FLOAT_TYPE(-_computeAttenuationConstant(frequency)/1000) for frequency in frequencies]
+    wavenumbers = [_FLOAT_TYPE(2*np.pi*frequency/(_C*1000)) for frequency in frequencies]
+    # Scales each frequency's energy by its tone gain and dBA weighting
+    energy_scales = [
+        _FLOAT_TYPE(tone_gain**2 * 10**((_computeDBAWeight(frequency) if dBA else 0)/10))
+        for frequency, tone_gain in zip(frequencies, tone_gains)
+    ]
+
+    for index in _iterateBlocks(energy.shape):
+        x_vals, y_vals, z_vals = _blockCoordinates(axes_values, index)
+        block_shape = energy[index].shape
+        block_waves = np.zeros((len(frequencies),) + block_shape, dtype=_COMPLEX_TYPE)
+
+        for batch, profile_positions in batches:
+            with _profileStage("distances_angles", profile_positions):
+                distances, angles_cosine = _computeBlockGeometry(batch, x_vals, y_vals, z_vals)
+
+            with _profileStage("beam_response", profile_positions):
+                beam_angle_factors = _computeBeamResponse(angles_cosine)
+
+            with _profileStage("attenuation", profile_positions):
+                # Attenuation due to distance only - the atmospheric attenuation is applied for each frequency
+                amplitudes = _computeAttenuationFactors(distances, attenuation_constant=0)
+                np.multiply(amplitudes, beam_angle_factors, out=amplitudes)
+                np.multiply(amplitudes, _FLOAT_TYPE(_PRESS_AMPLITUDE * R0), out=amplitudes)
+
+            for block, attenuation_constant, wavenumber in zip(block_waves, attenuation_constants, wavenumbers):
+                with _profileStage("phasor", profile_positions):
+                    frequency_amplitudes = np.multiply(distances, attenuation_constant)
+                    np.exp(frequency_amplitudes, out=frequency_amplitudes)
+                    np.multiply(frequency_amplitudes, amplitudes, out=frequency_amplitudes)
+
+                    phase_offsets = np.multiply(distances, wavenumber)
+                    np.add(phase_offsets, batch[2], out=phase_offsets)
+
+                    # Summing the batch's wave phasors straight onto the block, as in the main kernel
+                    phasor_part = np.cos(phase_offsets)
+                    np.add(block.real, np.einsum("i...,i...->...", phasor_part, frequency_amplitudes), out=block.real)
+
+                    np.sin(phase_offsets, out=phasor_part)
+                    np.add(block.imag, np.einsum("i...,i...->...", phasor_part, frequency_amplitudes), out=block.imag)
+
+        with _profileStage("reduction"):
+            block_energy = energy[index]
+            for frequency_no, (block, tone_gain, energy_scale) in enumerate(zip(block_waves, tone_gains, energy_scales)):
+                amplitude_block = np.abs(block)
+                if fields is not None:
+                    np.multiply(amplitude_block, _FLOAT_TYPE(tone_gain), out=fields[frequency_no][index])
+
+                np.square(amplitude_block, out=amplitude_block)
+                np.multiply(amplitude_block, energy_scale, out=amplitude_block)
+                np.add(block_energy, amplitude_block, out=block_energy)
+
+def _sweepSlab(task):
+    """
+    Worker function - simulates a slab of rows of the grid at every frequency of a frequency sweep
+    task is a ((start, stop) rows, grid axes values, transducers, frequencies, tone gains, keep fields) tuple
+
+    Returns the slab's start row, its energy matrix, its amplitudes at each frequency (None unless keep fields is True),
+    and the worker's profiling records
+    """
+    (start, stop), axes_values, transducers, frequencies, tone_gains, keep_fields = task
+    slab_axes = (axes_values[0][start:stop],) + tuple(axes_values[1:])
+    slab_shape = tuple(len(i) for i in slab_axes)
+
+    _logger(f"Started sweeping slab {start}-{stop}")
+    energy = np.zeros(slab_shape, dtype=_FLOAT_TYPE)
+    fields = np.empty((len(frequencies),) + slab_shape, dtype=_FLOAT_TYPE) if keep_fields else None
+    _accumulateSweepBlocks(energy, fields, slab_axes, transducers, frequencies, tone_gains)
+    _logger(f"Swept slab {start}-{stop}")
+
+    return start, energy, fields, _takeProfile()
+
+def runFrequencySweep(n_dims, frequencies, tone_gains=None, callback=None):
+    """
+    Simulates the grid (2D or 3D) at each of a list of frequencies, reusing the geometry between them
+    The grid is worked through STREAM_SLAB_ROWS rows at a time (in parallel, depending on CPU_CORES and EXECUTOR),
+    and each slab block by block - the distances, angles and beam angle response of each block are computed once,
+    and every frequency is swept through before moving on, as only the wavelength, atmospheric attenuation and
+    dBA weighting change with frequency. The energy of every frequency is summed block by block too, so memory usage
+    doesn't grow with the number of transducers or frequencies
+
+    tone_gains optionally scales the transducers' amplitude at each frequency, e.g. for multi-tone signals
+    callback(frequency, sim_matrix_db) is optionally called with each frequency's results once they're all computed
+    - they're only kept if it's given, in memory up to _SWEEP_FIELDS_BYTES and in a temporary file on disk beyond that
+
+    Returns the broadband level in dB/dBA - the energy sum of every frequency's (weighted) sound
+    """
+    axes_values = _gridAxes(n_dims)
+    shape = tuple(len(i) for i in axes_values)
+    n_cells = int(np.prod(shape))
+    transducers = _TRANSDUCER_PARAMETERS
+    frequencies = list(frequencies)
+    tone_gains = [1]*len(frequencies) if tone_gains is None else list(tone_gains)
+
+    fields_shape = (len(frequencies),) + shape
+    fields_on_disk = callback is not None and n_cells*len(frequencies)*np.dtype(_FLOAT_TYPE).itemsize > _SWEEP_FIELDS_BYTES
+
+    with tempfile.TemporaryDirectory() if fields_on_disk else nullcontext() as temp_dir:
+        if callback is None:
+            fields = None
+        elif fields_on_disk:
+            fields = np.lib.format.open_memmap(os.path.join(temp_dir, "fields.npy"), "w+", _FLOAT_TYPE, fields_shape)
+        else:
+            fields = np.empty(fields_shape, dtype=_FLOAT_TYPE)
+
+        n_rows = shape[0]
+        tasks = [
+            ((start, min(start+STREAM_SLAB_ROWS, n_rows)), axes_values, transducers, frequencies, tone_gains, fields is not None)
+            for start in range(0, n_rows, STREAM_SLAB_ROWS)
+        ]
+        broadband_energy = np.empty(shape, dtype=_FLOAT_TYPE)
+
+        _logger(f"Sweeping {len(frequencies)} frequencies over {len(tasks)} slabs")
+        executor = _chooseExecutor(n_cells, len(transducers)*len(frequencies))
+        for start, slab_energy, slab_fields, records in _mapTasks(_sweepSlab, tasks, executor):
+            broadband_energy[start:start+len(slab_energy)] = slab_energy
+            if fields is not None:
+                fields[:, start:start+len(slab_energy)] = slab_fields
+            _mergeProfile(records)
+        _logger("Swept frequencies")
+        _writeProfileReport()
+
+        if callback is not None:
+            for frequency_no, frequency in enumerate(frequencies):
+                callback(frequency, _convertTodB(fields[frequency_no], frequency))
+        # The temporary file can't be deleted while it's still memory-mapped
+        del fields
+
+    # Each frequency's weighting is already applied to its energy
+    np.sqrt(broadband_energy, out=broadband_energy)
+
+    return _convertTodB(broadband_energy, apply_weighting=False)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+from functools import partial
+import numpy as np
+import simulation
+
+class SimulationSession:
+    """
+    Keeps the summed complex wave of a simulation (2D or 3D) in memory, so transducers can be added, moved,
+    re-phased or removed one at a time - each change only computes the waves of the transducer it affects,
+    subtracting its old wave and adding its new one, instead of recomputing every transducer
+
+    Uses the simulation settings at the time it's created - create a new session after calling configureSimulation()
+    Suited to interactive layout editors and optimisation loops, e.g.:
+        session = SimulationSession(3)
+        session.moveTransducer(0, position=[20, 5, 0])
+        volume_db = session.getVolume()
+    """
+    def __init__(self, n_dims, transducers=None, keep_transducer_fields=False):
+        """
+        transducers is a list in the same format as TRANSDUCERS in SIM_CONFIG, which is used if it isn't given
+
+        If keep_transducer_fields is True, every transducer's wave is kept in memory (one extra grid per transducer),
+        so removing a transducer or changing its phase doesn't compute anything. Otherwise, the old wave is recomputed
+        to subtract it
+        """
+        self.n_dims = n_dims
+        self.keep_transducer_fields = keep_transducer_fields
+        self.axes_values = simulation._gridAxes(n_dims)
+        self.shape = tuple(len(i) for i in self.axes_values)
+
+        if transducers is None:
+            self.transducers = list(simulation._TRANSDUCER_PARAMETERS)
+        else:
+            self.transducers = [self._toParameters(*i) for i in transducers]
+        self._transducer_fields = [None] * len(self.transducers)
+
+        self.resync()
+
+    def _toParameters(self, position, transducer_axis, transducer_phase):
+        """
+        Converts a transducer from the TRANSDUCERS format into the (position, central axis, phase offset) tuple used by the engine
+        """
+        return (
+            tuple(float(i) for i in position),
+            np.array(transducer_axis, dtype=simulation._FLOAT_TYPE),
+            float(transducer_phase)
+        )
+
+    def _accumulate(self, weight, matrix):
+        """
+        Reduction for the engine - adds a transducer's wave matrix, scaled by the complex weight, into the summed wave
+        """
+        if weight == 1:
+            self.complex_field += matrix
+        else:
+            self.complex_field += matrix * simulation._COMPLEX_TYPE(weight)
+
+    def _zeroPhaseField(self, index):
+        """
+        Returns a transducer's wave with no phase offset, from memory if it's being kept
+        """
+        if self._transducer_fields[index] is not None:
+            return self._transducer_fields[index]
+
+        position, transducer_axis, _ = self.transducers[index]
+        field = simulation._computeComplexField(self.axes_values, [(position, transducer_axis, 0.0)], np.copy)
+        if self.keep_transducer_fields:
+            self._transducer_fields[index] = field
+
+        return field
+
+    def _applyTransducer(self, index, sign):
+        """
+        Adds (sign = 1) or subtracts (sign = -1) a transducer's wave to/from the summed wave
+        """
+        if self.keep_transducer_fields:
+            phasor = np.exp(1j*self.transducers[index][2])
+            self._accumulate(sign*phasor, self._zeroPhaseField(index))
+        else:
+            # Computed straight into the summed wave, without holding a copy of the transducer's wave
+            simulation._computeComplexField(
+                self.axes_values, [self.transducers[index]], partial(self._accumulate, sign)
+            )
+
+    def resync(self):
+        """
+        Recomputes the summed wave from scratch
+        Each change adds a little floating point rounding error, so this is worth calling after many changes
+        """
+        self.complex_field = np.zeros(self.shape, dtype=simulation._COMPLEX_TYPE)
+
+        if self.keep_transducer_fields:
+            for index in range(len(self.transducers)):
+                self._applyTransducer(index, 1)
+        elif self.transducers:
+            simulation._computeComplexField(self.axes_values, self.transducers, partial(self._accumulate, 1))
+
+    def addTransducer(self, position, transducer_axis, transducer_phase=0):
+        """
+        Adds a transducer to the array, returning its index
+        """
+        self.transducers.append(self._toParameters(position, transducer_axis, transducer_phase))
+        self._transducer_fields.append(None)
+        self._applyTransducer(len(self.transducers) - 1, 1)
+
+        return len(self.transducers) - 1
+
+    def removeTransducer(self, index):
+        """
+        Removes a transducer from the array - the indices of the transducers after it go down by one
+        """
+        self._applyTransducer(index, -1)
+        del self.transducers[index]
+        del self._transducer_fields[index]
+
+    def moveTransducer(self, index, position=None, transducer_axis=None, transducer_phase=None):
+        """
+        Changes a transducer's position, central axis and/or phase offset - anything not given is left as it is
+        A change of phase alone only rotates the transducer's existing wave, rather than computing a new one
+        """
+        old_position, old_axis, old_phase = self.transducers[index]
+        new_transducer = self._toParameters(
+            old_position if position is None else position,
+            old_axis if transducer_axis is None else transducer_axis,
+            old_phase if transducer_phase is None else transducer_phase
+        )
+
+        if new_transducer[0] == old_position and np.array_equal(new_transducer[1], old_axis):
+            # The wave's shape is unchanged, so it's just rotated to its new phase
+            phasor_change = np.exp(1j*new_transducer[2]) - np.exp(1j*old_phase)
+            self._accumulate(phasor_change, self._zeroPhaseField(index))
+        else:
+            self._applyTransducer(index, -1)
+            self._transducer_fields[index] = None
+            self.transducers[index] = new_transducer
+            self._applyTransducer(index, 1)
+
+        self.transducers[index] = new_transducer
+
+    def getTransducers(self):
+        """
+        Returns the current transducer array, in the same format as TRANSDUCERS in SIM_CONFIG
+        """
+        return [[list(position), transducer_axis.tolist(), transducer_phase]
+            for position, transducer_axis, transducer_phase in self.transducers]
+
+    def getVolume(self):
+        """
+        Returns the volume in dB/dBA across the grid, for the current transducer array
+        """
+        return simulation._convertTodB(np.abs(self.complex_field))